@@ -0,0 +1,95 @@
+import numpy as np
+
+from color_processor import ColorProcessor
+from metrics import incr
+from utils import get_flag_image
+
+# Widths available from flagcdn, smallest first
+FLAG_WIDTHS = (20, 40, 80, 160, 320, 640, 1280, 2560)
+
+# Default pyramid for adaptive extraction
+ADAPTIVE_WIDTHS = (80, 160, 320, 640)
+
+
+def palettes_match(colors_a,
+                   proportions_a,
+                   colors_b,
+                   proportions_b,
+                   color_tolerance=12.0,
+                   proportion_tolerance=0.02):
+    """Return True when two palettes agree within the given tolerances.
+
+    The palettes must have the same number of colors, each color must pair
+    up one-to-one with its nearest counterpart no further than
+    ``color_tolerance`` away in RGB, and paired proportions may differ by at
+    most ``proportion_tolerance``.
+    """
+    if len(colors_a) != len(colors_b):
+        return False
+    colors_a = np.asarray(colors_a, dtype=np.float64)
+    colors_b = np.asarray(colors_b, dtype=np.float64)
+    distances = np.linalg.norm(colors_a[:, np.newaxis] -
+                               colors_b[np.newaxis, :],
+                               axis=2)
+    pairs = distances.argmin(axis=1)
+    if len(np.unique(pairs)) != len(pairs):
+        return False
+    if distances[np.arange(len(pairs)), pairs].max() > color_tolerance:
+        return False
+    proportion_gap = np.abs(
+        np.asarray(proportions_a) - np.asarray(proportions_b)[pairs])
+    return proportion_gap.max() <= proportion_tolerance
+
+
+def _levels(country_code, image, widths):
+    """Yield (width, image) pairs from the coarsest level to the finest.
+
+    Levels of a local image report their actual width, and an image
+    narrower than every width is yielded once as it is.
+    """
+    for width in widths:
+        if country_code is not None:
+            yield width, get_flag_image(country_code, width)
+            continue
+        factor = image.width // width
+        if factor < 1:
+            if width == widths[0]:
+                yield image.width, image
+            break
+        # Box-reduce the decoded image; factor 1 is the original. Reduced
+        # levels are at least as wide as the nominal width, so report theirs
+        level = image.reduce(factor) if factor > 1 else image
+        yield level.width, level
+
+
+def extract_colors_adaptive(country_code=None,
+                            image=None,
+                            widths=ADAPTIVE_WIDTHS,
+                            color_tolerance=12.0,
+                            proportion_tolerance=0.02,
+                            cache=None,
+                            **extract_kwargs):
+    """Extract a palette coarse-to-fine, stopping once it is stable.
+
+    Levels are flagcdn renditions of ``country_code`` at each of ``widths``,
+    or ``image`` box-reduced to those widths. Extraction starts at the
+    smallest level and moves up only while consecutive levels disagree
+    beyond the tolerances (see ``palettes_match``). Returns the colors,
+    proportions and the width the palette settled at.
+    """
+    if (country_code is None) == (image is None):
+        raise ValueError("Pass exactly one of country_code or image")
+    previous = None
+    for width, level_image in _levels(country_code, image, widths):
+        processor = ColorProcessor(level_image, cache=cache)
+        colors, proportions = processor.extract_colors(**extract_kwargs)
+        incr('adaptive.levels')
+        if previous is not None and palettes_match(
+                previous[0], previous[1], colors, proportions,
+                color_tolerance, proportion_tolerance):
+            incr('adaptive.settled')
+            return colors, proportions, width
+        previous = (colors, proportions)
+    if previous is None:
+        raise ValueError("No resolution level is available for this image")
+    return previous[0], previous[1], width
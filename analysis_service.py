@@ -0,0 +1,128 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from color_processor import ColorProcessor
+from extraction_cache import get_shared_cache
+from flag_cache import get_default_cache
+from metrics import incr, span
+
+# Distinct analyses allowed to wait or run at once before new ones are refused
+MAX_PENDING = 64
+
+
+class ServiceBusyError(RuntimeError):
+    """Raised when the analysis queue is full; the caller should retry."""
+
+
+def _limit_worker_threads(threads):
+    # OpenMP thread counts are per thread, so each worker caps only its own
+    # KMeans fits and the pool's total CPU use stays workers * threads
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(limits=threads, user_api='openmp')
+
+
+def _analyze_flag(country_code, width, extract_kwargs):
+    with span('analysis.fetch'):
+        flag_png = get_default_cache().fetch(country_code, width)
+    processor = ColorProcessor(Image.open(BytesIO(flag_png)),
+                               cache=get_shared_cache())
+    with span('analysis.extract'):
+        colors, proportions = processor.extract_colors(**extract_kwargs)
+    return {
+        'flag_png': flag_png,
+        'colors': colors,
+        'proportions': proportions,
+        'color_names': processor.get_color_names(),
+        'weighted_mix': processor.get_weighted_mix(),
+        'equal_mix': processor.get_equal_mix()
+    }
+
+
+class AnalysisService:
+    """Bounded worker pool that runs flag analyses for every session.
+
+    Requests for the same (country, width, parameters) key while one is
+    already queued or running share that computation's future instead of
+    repeating it (single-flight). At most ``max_pending`` distinct analyses
+    are outstanding; beyond that ``analyze_flag`` raises
+    ``ServiceBusyError`` rather than letting the queue, and latency, grow.
+    """
+
+    def __init__(self,
+                 max_workers=None,
+                 threads_per_worker=1,
+                 max_pending=MAX_PENDING):
+        if max_workers is None:
+            max_workers = min(8, os.cpu_count() or 1)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='analysis',
+            initializer=_limit_worker_threads,
+            initargs=(threads_per_worker, ))
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def pending(self):
+        """Number of distinct analyses queued or running."""
+        with self._lock:
+            return len(self._in_flight)
+
+    def submit(self, key, func, *args):
+        """Run func(*args) on the pool, sharing the future of an equal key."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                incr('analysis.coalesced')
+                return future
+            if len(self._in_flight) >= self.max_pending:
+                incr('analysis.rejected')
+                raise ServiceBusyError(
+                    f"{len(self._in_flight)} analyses already pending")
+            future = self._executor.submit(func, *args)
+            self._in_flight[key] = future
+            incr('analysis.submitted')
+        future.add_done_callback(lambda _: self._finish(key, future))
+        return future
+
+    def _finish(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def analyze_flag(self, country_code, width=640, **extract_kwargs):
+        """Return a future for the analysis of one flag.
+
+        The result holds the flag PNG bytes, the palette colors, their
+        names and proportions, and the weighted and equal mixes.
+        """
+        key = (country_code.upper(), width,
+               tuple(sorted(extract_kwargs.items())))
+        return self.submit(key, _analyze_flag, country_code, width,
+                           extract_kwargs)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_analysis_service():
+    """Return the process-wide analysis service shared by all sessions.
+
+    ``FLAG_ANALYSIS_WORKERS`` overrides the number of worker threads.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            workers = os.environ.get('FLAG_ANALYSIS_WORKERS')
+            _service = AnalysisService(
+                max_workers=int(workers) if workers else None)
+        return _service
@@ -0,0 +1,159 @@
+"""Extract flag palettes from the command line, without the Streamlit app.
+
+Analyze flags by country code, or local images and directories of images::
+
+    python analyze.py us fr jp --n-colors auto
+    python analyze.py ./flags --format json --output palettes.json
+
+With no sources every country in the built-in list is analyzed. Palettes are
+streamed as JSON lines by default, one per flag as soon as it finishes.
+"""
+import argparse
+import json
+import os
+import sys
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp')
+
+
+def _n_colors(value):
+    return value if value == 'auto' else int(value)
+
+
+def collect_sources(items):
+    """Split command line items into country codes and local image paths.
+
+    Directories contribute the images directly inside them, in name order.
+    """
+    country_codes, image_paths = [], []
+    for item in items:
+        if os.path.isdir(item):
+            image_paths.extend(
+                os.path.join(item, name) for name in sorted(os.listdir(item))
+                if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif os.path.isfile(item):
+            image_paths.append(item)
+        else:
+            country_codes.append(item.upper())
+    return country_codes, image_paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('sources',
+                        nargs='*',
+                        help="country codes, image files or directories")
+    parser.add_argument('--output',
+                        '-o',
+                        default='-',
+                        help="output file, or - for stdout")
+    parser.add_argument('--format', choices=('jsonl', 'json'), default='jsonl')
+    parser.add_argument('--n-colors', type=_n_colors, default=5)
+    parser.add_argument('--algorithm',
+                        choices=('histogram', 'kmeans'),
+                        default='histogram')
+    parser.add_argument('--space',
+                        choices=('rgb', 'lab', 'oklab'),
+                        default='rgb')
+    parser.add_argument('--width',
+                        type=int,
+                        default=640,
+                        help="flagcdn rendition width for country codes")
+    parser.add_argument('--adaptive',
+                        action='store_true',
+                        help="analyze small renditions first, "
+                        "growing until the palette is stable")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help="analysis processes (default: one per CPU)")
+    parser.add_argument('--download-workers', type=int, default=8)
+    parser.add_argument('--cache-dir', help="flag download cache directory")
+    parser.add_argument('--extraction-cache-dir',
+                        help="persist extraction results in this directory")
+    parser.add_argument('--offline',
+                        action='store_true',
+                        help="only use flags already in the cache")
+    args = parser.parse_args(argv)
+
+    # Worker processes pick these up when they create their caches
+    if args.cache_dir:
+        os.environ['FLAG_CACHE_DIR'] = args.cache_dir
+    if args.extraction_cache_dir:
+        os.environ['FLAG_EXTRACTION_CACHE_DIR'] = args.extraction_cache_dir
+    if args.offline:
+        os.environ['FLAG_OFFLINE'] = '1'
+
+    from batch import iter_palettes
+    from color_names import get_color_namer, name_palettes
+    from countries import all_countries, get_country_list
+    from flag_cache import atomic_write
+
+    countries = all_countries(subdivisions=True)
+    if args.sources:
+        country_codes, image_paths = collect_sources(args.sources)
+    else:
+        country_codes, image_paths = list(get_country_list()), []
+
+    local_paths = set(image_paths)
+    stream = args.format == 'jsonl'
+    output = sys.stdout
+    if stream and args.output != '-':
+        output = open(args.output, 'w')
+    results, failures = {}, 0
+    try:
+        for source, record, error in iter_palettes(
+                country_codes,
+                image_paths,
+                n_colors=args.n_colors,
+                width=args.width,
+                download_workers=args.download_workers,
+                extract_workers=args.workers,
+                adaptive=args.adaptive,
+                algorithm=args.algorithm,
+                space=args.space):
+            if error is not None:
+                failures += 1
+                print(f"{source}: {error}", file=sys.stderr)
+                continue
+            if source in local_paths:
+                name = os.path.splitext(os.path.basename(source))[0]
+                record = {'path': source, 'name': name, **record}
+            else:
+                record = {
+                    'code': source,
+                    'name': countries.get(source, source),
+                    **record
+                }
+            if stream:
+                record['names'] = get_color_namer().name_hex(record['colors'])
+                output.write(json.dumps(record) + '\n')
+                output.flush()
+            else:
+                results[source] = record
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if not stream:
+        # Same layout as country_colors.json, in the order sources were given
+        palettes = {}
+        for source in country_codes + image_paths:
+            if source in results:
+                record = results[source]
+                palettes[record['name']] = {
+                    'colors': record['colors'],
+                    'proportions': record['proportions']
+                }
+        # Name the colors of every palette in one batched query
+        name_palettes(palettes.values())
+        text = json.dumps(palettes, indent=2)
+        if args.output == '-':
+            print(text)
+        else:
+            atomic_write(args.output, text.encode())
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,347 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from io import BytesIO
+
+from PIL import Image
+
+from adaptive_extraction import ADAPTIVE_WIDTHS, extract_colors_adaptive
+from color_processor import EXTRACTION_VERSION, ColorProcessor
+from extraction_cache import get_shared_cache
+from flag_cache import atomic_write, get_default_cache
+from metrics import incr
+from utils import file_sha256, get_country_list, rgb_to_hex
+
+
+def _download_flag(country_code, width):
+    """Download (or revalidate) the PNG bytes for one flag."""
+    return get_default_cache().fetch(country_code, width)
+
+
+def _fingerprint_flag(country_code, width):
+    """Revalidate one flag; return its cached ref and its PNG bytes."""
+    cache = get_default_cache()
+    png_bytes = cache.fetch(country_code, width)
+    return cache.metadata(country_code, width), png_bytes
+
+
+def _palette_record(colors, proportions, **extra):
+    return {
+        'colors': [rgb_to_hex(color) for color in colors],
+        'proportions': proportions.tolist(),
+        **extra
+    }
+
+
+def _extract_palette(png_bytes, n_colors, extract_kwargs=None):
+    """Decode a flag PNG and extract its palette; runs in a worker process."""
+    processor = ColorProcessor(Image.open(BytesIO(png_bytes)),
+                               cache=get_shared_cache())
+    colors, proportions = processor.extract_colors(n_colors=n_colors,
+                                                   **(extract_kwargs or {}))
+    return _palette_record(colors, proportions)
+
+
+def _extract_palette_file(path, n_colors, extract_kwargs=None,
+                          adaptive=False):
+    """Extract the palette of a local image file; runs in a worker process.
+
+    With ``adaptive``, the image is analyzed coarse-to-fine like a flag.
+    """
+    with Image.open(path) as image:
+        if adaptive:
+            colors, proportions, width = extract_colors_adaptive(
+                image=image,
+                n_colors=n_colors,
+                cache=get_shared_cache(),
+                **(extract_kwargs or {}))
+            return _palette_record(colors, proportions, width=width)
+        processor = ColorProcessor(image, cache=get_shared_cache())
+    colors, proportions = processor.extract_colors(n_colors=n_colors,
+                                                   **(extract_kwargs or {}))
+    return _palette_record(colors, proportions)
+
+
+def _extract_palette_adaptive(country_code, n_colors, extract_kwargs=None):
+    """Fetch and analyze a flag coarse-to-fine; runs in a worker process."""
+    colors, proportions, width = extract_colors_adaptive(
+        country_code=country_code,
+        n_colors=n_colors,
+        cache=get_shared_cache(),
+        **(extract_kwargs or {}))
+    return _palette_record(colors, proportions, width=width)
+
+
+def iter_palettes(country_codes=(),
+                  image_paths=(),
+                  n_colors=5,
+                  width=640,
+                  download_workers=8,
+                  extract_workers=None,
+                  adaptive=False,
+                  flags=None,
+                  **extract_kwargs):
+    """Analyze flags in parallel, yielding results as they finish.
+
+    Country codes are downloaded on a thread pool (or, with ``adaptive``,
+    fetched coarse-to-fine inside the workers) unless ``flags`` already maps
+    them to their PNG bytes, and local ``image_paths`` are read directly by
+    the workers; all analysis runs on a process pool. With ``adaptive``,
+    records carry the width each palette settled at.
+    Yields ``(source, record, error)`` tuples in completion order, where
+    source is the country code or path and exactly one of record and error
+    is set. Extra keyword arguments go to ``extract_colors``.
+    """
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+            ProcessPoolExecutor(max_workers=extract_workers,
+                                mp_context=multiprocessing.get_context(
+                                    'spawn')) as extractions:
+        stages = {}
+        flags = flags or {}
+        for code in country_codes:
+            if adaptive:
+                future = extractions.submit(_extract_palette_adaptive, code,
+                                            n_colors, extract_kwargs)
+                stages[future] = ('extract', code)
+            elif code in flags:
+                future = extractions.submit(_extract_palette, flags[code],
+                                            n_colors, extract_kwargs)
+                stages[future] = ('extract', code)
+            else:
+                future = downloads.submit(_download_flag, code, width)
+                stages[future] = ('download', code)
+        for path in image_paths:
+            future = extractions.submit(_extract_palette_file, path, n_colors,
+                                        extract_kwargs, adaptive)
+            stages[future] = ('extract', path)
+        in_flight = set(stages)
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, source = stages.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield source, None, e
+                    continue
+                if stage == 'download':
+                    extraction = extractions.submit(_extract_palette, result,
+                                                    n_colors, extract_kwargs)
+                    stages[extraction] = ('extract', source)
+                    in_flight.add(extraction)
+                    continue
+                yield source, result, None
+
+
+def read_checkpoint(path, params=None, fingerprints=None):
+    """Load finished countries from a JSONL checkpoint, keyed by country code.
+
+    A crash can leave the last line half written, so lines that do not parse
+    are skipped and that country is simply processed again. So are records
+    left by a run with other ``params`` or another ``EXTRACTION_VERSION``,
+    and, given ``fingerprints``, records of a since-changed source image.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r') as checkpoint_file:
+        for line in checkpoint_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if params is not None and (
+                    record.get('params') != params or
+                    record.get('extraction_version') != EXTRACTION_VERSION):
+                continue
+            if fingerprints is not None and record.get('sha256') != \
+                    fingerprints.get(record['code'], {}).get('sha256'):
+                continue
+            records[record['code']] = record
+    return records
+
+
+def records_to_country_colors(records, countries):
+    """Arrange checkpoint records as the country colors dict, in list order.
+
+    Every color is also given its nearest CSS name, all in one batched query.
+    """
+    from color_names import name_palettes
+
+    country_colors = {}
+    for country_code, country_name in countries.items():
+        record = records.get(country_code)
+        if record is not None:
+            country_colors[country_name] = {
+                'colors': record['colors'],
+                'proportions': record['proportions']
+            }
+    name_palettes(country_colors.values())
+    return country_colors
+
+
+def manifest_path(filename):
+    return os.path.splitext(filename)[0] + '.manifest.json'
+
+
+def read_manifest(filename):
+    """Load the per-country manifest stored next to a dataset, if any.
+
+    The manifest records the hash of the dataset it describes. If a run
+    stopped between writing the two files, or the dataset was edited, the
+    hashes differ and the manifest is ignored.
+    """
+    try:
+        with open(manifest_path(filename), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['dataset_sha256'] != file_sha256(filename):
+            return {}
+        return manifest['countries']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def unchanged_records(countries, fingerprints, params, filename):
+    """Reuse palettes from the existing dataset whose inputs are unchanged.
+
+    A country is unchanged when its source image hash, the extraction
+    parameters and ``EXTRACTION_VERSION`` all match its manifest entry.
+    """
+    manifest = read_manifest(filename)
+    try:
+        with open(filename, 'r') as json_file:
+            previous = json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+    records = {}
+    for code, fingerprint in fingerprints.items():
+        entry = manifest.get(code)
+        if (entry is None or entry.get('sha256') != fingerprint['sha256']
+                or entry.get('params') != params
+                or entry.get('extraction_version') != EXTRACTION_VERSION
+                or entry.get('name') not in previous):
+            continue
+        palette = previous[entry['name']]
+        records[code] = {
+            'code': code,
+            'name': countries[code],
+            'colors': palette['colors'],
+            'proportions': palette['proportions']
+        }
+    return records
+
+
+def rebuild_country_colors(filename='country_colors.json',
+                           checkpoint=None,
+                           countries=None,
+                           n_colors=5,
+                           width=640,
+                           download_workers=8,
+                           extract_workers=None,
+                           adaptive=False):
+    """Rebuild the country colors JSON with parallel download and extraction.
+
+    The rebuild is incremental: every flag is first revalidated against the
+    CDN (a conditional request, so unchanged flags cost no download) and
+    countries whose source image, parameters and extraction code version
+    match the manifest stored next to ``filename`` keep their palettes.
+
+    The remaining flags are analyzed on a process pool straight from the bytes
+    fetched for revalidation, so each costs a single request. Each finished
+    country is appended to a JSONL checkpoint straight away, so an interrupted
+    or partly failed run resumes where it stopped. Once every country is done
+    the checkpoint is compacted into ``filename``, the manifest is updated and
+    the checkpoint is removed.
+
+    With ``adaptive`` each worker fetches small renditions first and only
+    moves to larger ones until the palette is stable, instead of always
+    downloading the ``width`` rendition; change detection then uses the
+    smallest rendition.
+
+    Returns the country colors dict and a dict of failed country codes
+    mapped to their exception.
+    """
+    if countries is None:
+        countries = get_country_list()
+    if checkpoint is None:
+        checkpoint = f"{filename}.partial.jsonl"
+    params = {'n_colors': n_colors, 'width': width, 'adaptive': adaptive}
+    source_width = ADAPTIVE_WIDTHS[0] if adaptive else width
+    failures = {}
+
+    fingerprints, flags = {}, {}
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads:
+        futures = {
+            code: downloads.submit(_fingerprint_flag, code, source_width)
+            for code in countries
+        }
+        for code, future in futures.items():
+            try:
+                fingerprints[code], flags[code] = future.result()
+            except Exception as e:
+                failures[code] = e
+
+    records = unchanged_records(countries, fingerprints, params, filename)
+    incr('rebuild.unchanged', len(records))
+    records.update(read_checkpoint(checkpoint, params, fingerprints))
+    pending = [
+        code for code in countries
+        if code not in records and code not in failures
+    ]
+    # Adaptive workers fetch their own renditions
+    flags = {} if adaptive else {code: flags[code] for code in pending}
+
+    with open(checkpoint, 'a') as checkpoint_file:
+        for code, result, error in iter_palettes(
+                pending,
+                n_colors=n_colors,
+                width=width,
+                download_workers=download_workers,
+                extract_workers=extract_workers,
+                adaptive=adaptive,
+                flags=flags):
+            if error is not None:
+                failures[code] = error
+                continue
+            record = {
+                'code': code,
+                'name': countries[code],
+                'sha256': fingerprints[code]['sha256'],
+                'params': params,
+                'extraction_version': EXTRACTION_VERSION,
+                **result
+            }
+            checkpoint_file.write(json.dumps(record) + '\n')
+            checkpoint_file.flush()
+            records[code] = record
+            incr('rebuild.extracted')
+
+    country_colors = records_to_country_colors(records, countries)
+    # Leave the previous output and the checkpoint alone until a run completes
+    if not failures:
+        dataset = json.dumps(country_colors, indent=2).encode()
+        atomic_write(filename, dataset)
+        manifest = {
+            code: {
+                'name': countries[code],
+                'sha256': fingerprints[code]['sha256'],
+                'etag': fingerprints[code].get('etag'),
+                'source_width': source_width,
+                'params': params,
+                'extraction_version': EXTRACTION_VERSION
+            }
+            for code in countries
+        }
+        atomic_write(
+            manifest_path(filename),
+            json.dumps(
+                {
+                    'dataset_sha256': hashlib.sha256(dataset).hexdigest(),
+                    'countries': manifest
+                },
+                indent=2).encode())
+        os.remove(checkpoint)
+    return country_colors, failures
@@ -0,0 +1,354 @@
+"""Offline benchmarks for the extraction, mixing and clustering hot paths.
+
+Run the suite and write machine-readable results::
+
+    python benchmark.py run --output benchmark-results.json
+
+Compare two runs and fail on slowdowns beyond a threshold::
+
+    python benchmark.py compare baseline.json benchmark-results.json
+
+Every input is synthesized locally, so no flags are fetched from flagcdn.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+# Never touch the network, even if a code path tries to fetch a flag
+os.environ.setdefault('FLAG_OFFLINE', '1')
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+SUPERSAMPLE = 4
+DEFAULT_WIDTHS = (80, 160, 320, 640, 1280)
+DEFAULT_N_COLORS = (3, 5, 8)
+
+def _stripes(draw, width, height):
+    colors = [(0, 38, 84), (255, 255, 255), (237, 41, 57)]
+    for i, color in enumerate(colors):
+        draw.rectangle(
+            [i * width / 3, 0, (i + 1) * width / 3, height], fill=color)
+    return colors
+
+
+def _emblem(draw, width, height):
+    draw.rectangle([0, 0, width, height], fill=(255, 255, 255))
+    radius = height * 0.3
+    draw.ellipse([
+        width / 2 - radius, height / 2 - radius, width / 2 + radius,
+        height / 2 + radius
+    ],
+                 fill=(188, 0, 45))
+    return [(255, 255, 255), (188, 0, 45)]
+
+
+def _stars(draw, width, height):
+    red, white, blue = (178, 34, 52), (255, 255, 255), (60, 59, 110)
+    stripe = height / 13
+    draw.rectangle([0, 0, width, height], fill=white)
+    for i in range(0, 13, 2):
+        draw.rectangle([0, i * stripe, width, (i + 1) * stripe], fill=red)
+    draw.rectangle([0, 0, width * 0.4, 7 * stripe], fill=blue)
+    for row in range(9):
+        for col in range(6):
+            x = width * 0.4 * (col + 0.5) / 6
+            y = 7 * stripe * (row + 0.5) / 9
+            r = stripe * 0.3
+            draw.ellipse([x - r, y - r, x + r, y + r], fill=white)
+    return [red, white, blue]
+
+
+def _cross(draw, width, height):
+    draw.rectangle([0, 0, width, height], fill=(0, 106, 167))
+    bar = height * 0.2
+    draw.rectangle([0, (height - bar) / 2, width, (height + bar) / 2],
+                   fill=(254, 204, 0))
+    draw.rectangle([width * 0.3, 0, width * 0.3 + bar, height],
+                   fill=(254, 204, 0))
+    return [(0, 106, 167), (254, 204, 0)]
+
+
+def _gradient(draw, width, height):
+    draw.rectangle([0, 0, width, height], fill=(0, 122, 61))
+    draw.polygon([(0, 0), (width, 0), (0, height)], fill=(252, 209, 22))
+    return [(0, 122, 61), (252, 209, 22)]
+
+
+# name -> (draw function, aspect ratio, blur radius at supersampled scale)
+SYNTHETIC_FLAGS = {
+    'stripes': (_stripes, 2 / 3, 0),
+    'emblem': (_emblem, 2 / 3, 0),
+    'stars': (_stars, 10 / 19, 0),
+    'cross': (_cross, 8 / 11, 0),
+    'gradient': (_gradient, 2 / 3, 6),
+}
+
+
+def synthesize_flag(name, width):
+    """Render a synthetic flag with anti-aliased edges and its ground truth.
+
+    The flag is drawn at a higher resolution and downsampled, so edges carry
+    the same blend pixels as real flag PNGs. The ground truth proportions
+    are measured on the sharp high-resolution drawing.
+    """
+    draw_flag, aspect, blur = SYNTHETIC_FLAGS[name]
+    height = max(1, int(round(width * aspect)))
+    big = Image.new('RGB', (width * SUPERSAMPLE, height * SUPERSAMPLE))
+    colors = draw_flag(ImageDraw.Draw(big), *big.size)
+    sharp = np.array(big).reshape(-1, 3)
+    proportions = [
+        float(np.mean(np.all(sharp == color, axis=1))) for color in colors
+    ]
+    if blur:
+        big = big.filter(ImageFilter.GaussianBlur(blur))
+    image = big.resize((width, height), Image.LANCZOS)
+    return image, np.array(colors), np.array(proportions)
+
+
+def palette_accuracy(colors, proportions, true_colors, true_proportions):
+    """Score an extracted palette against the ground truth.
+
+    ``color_error`` is the proportion-weighted RGB distance from each true
+    color to its nearest extracted color. ``proportion_error`` is the total
+    variation distance after assigning every extracted color to its nearest
+    true color.
+    """
+    colors = np.asarray(colors, dtype=np.float64)
+    distances = np.linalg.norm(true_colors[:, np.newaxis] -
+                               colors[np.newaxis, :],
+                               axis=2)
+    color_error = float(np.sum(distances.min(axis=1) * true_proportions))
+    assigned = np.bincount(distances.argmin(axis=0),
+                           weights=proportions,
+                           minlength=len(true_colors))
+    proportion_error = float(0.5 * np.sum(np.abs(assigned - true_proportions)))
+    return {
+        'color_error': color_error,
+        'proportion_error': proportion_error,
+        'n_extracted': int(len(colors))
+    }
+
+
+def measure(func, repeat):
+    """Time func over repeat runs and record the peak traced memory."""
+    func()  # Warm up imports and caches outside the measurement
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        'time_s': float(np.median(times)),
+        'time_min_s': float(min(times)),
+        'peak_mb': peak / 2**20
+    }
+
+
+def bench_extraction(widths, n_colors_values, repeat):
+    from color_processor import ColorProcessor
+
+    for name in SYNTHETIC_FLAGS:
+        for width in widths:
+            image, true_colors, true_proportions = synthesize_flag(name, width)
+            for n_colors in n_colors_values:
+                for algorithm in ('histogram', 'kmeans'):
+                    result, stats = measure(
+                        lambda: ColorProcessor(image).extract_colors(
+                            n_colors=n_colors, algorithm=algorithm), repeat)
+                    label = f"{algorithm}/{name}/w{width}/k{n_colors}"
+                    yield {
+                        'name': f"extract/{label}",
+                        'group': 'extract',
+                        'params': {
+                            'flag': name,
+                            'width': width,
+                            'n_colors': n_colors,
+                            'algorithm': algorithm
+                        },
+                        **stats,
+                        **palette_accuracy(result[0], result[1], true_colors,
+                                           true_proportions)
+                    }
+
+
+def _random_palettes(n_palettes, rng):
+    lengths = rng.integers(2, 8, size=n_palettes)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    colors = rng.integers(0, 256, size=(offsets[-1], 3))
+    proportions = rng.random(offsets[-1])
+    return colors, proportions, offsets
+
+
+def bench_mixing(sizes, repeat):
+    from utils import mix_palettes
+
+    rng = np.random.default_rng(42)
+    for n_palettes in sizes:
+        colors, proportions, offsets = _random_palettes(n_palettes, rng)
+        _, stats = measure(lambda: mix_palettes(colors, offsets, proportions),
+                           repeat)
+        yield {
+            'name': f"mix/palettes/n{n_palettes}",
+            'group': 'mix',
+            'params': {
+                'n_palettes': n_palettes
+            },
+            **stats
+        }
+
+
+def bench_clustering(sizes, repeat):
+    from sklearn.cluster import KMeans
+
+    from color_clustering import fit_clusters, voxel_bins
+
+    rng = np.random.default_rng(42)
+    for n_points in sizes:
+        colors = rng.integers(0, 256, size=(n_points, 3), dtype=np.uint8)
+        X = colors.astype(np.float64)
+        cases = [
+            ('kmeans',
+             lambda: KMeans(n_clusters=5, random_state=42).fit_predict(X)),
+            ('minibatch', lambda: fit_clusters(X, 5, large=True)),
+            ('voxel_bins', lambda: voxel_bins(colors)),
+        ]
+        for case, func in cases:
+            _, stats = measure(func, repeat)
+            yield {
+                'name': f"cluster/{case}/n{n_points}",
+                'group': 'cluster',
+                'params': {
+                    'n_points': n_points,
+                    'n_clusters': 5
+                },
+                **stats
+            }
+
+
+def _n_colors(value):
+    return value if value == 'auto' else int(value)
+
+
+def environment():
+    import sklearn
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'cpu_count': os.cpu_count(),
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def run(args):
+    results = []
+    benchmarks = {
+        'extract':
+        lambda: bench_extraction(args.widths, args.n_colors, args.repeat),
+        'mix':
+        lambda: bench_mixing((100, 1000, 10000, 100000), args.repeat),
+        'cluster':
+        lambda: bench_clustering((400, 4000, 40000, 100000),
+                                 args.repeat),
+    }
+    for group in args.groups:
+        for result in benchmarks[group]():
+            results.append(result)
+            line = f"{result['name']:<45} {result['time_s'] * 1000:9.2f} ms"
+            if 'peak_mb' in result:
+                line += f" {result['peak_mb']:8.2f} MB"
+            if 'color_error' in result:
+                line += (f"  color err {result['color_error']:6.2f}"
+                         f"  prop err {result['proportion_error']:.4f}")
+            print(line)
+    with open(args.output, 'w') as output_file:
+        json.dump({
+            'environment': environment(),
+            'results': results
+        },
+                  output_file,
+                  indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+    return 0
+
+
+def compare(args):
+    with open(args.baseline, 'r') as baseline_file:
+        baseline = {r['name']: r for r in json.load(baseline_file)['results']}
+    with open(args.current, 'r') as current_file:
+        current = {r['name']: r for r in json.load(current_file)['results']}
+
+    regressions = []
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name]['time_s'], current[name]['time_s']
+        ratio = new / old if old > 0 else float('inf')
+        flag = ''
+        # Ignore noise on sub-millisecond timings
+        if ratio > 1 + args.threshold and new - old > args.min_delta:
+            flag = '  SLOWER'
+            regressions.append(name)
+        print(f"{name:<45} {old * 1000:9.2f} -> {new * 1000:9.2f} ms "
+              f"({ratio:5.2f}x){flag}")
+    for name in sorted(set(baseline) ^ set(current)):
+        source = 'baseline' if name in baseline else 'current'
+        print(f"{name:<45} only in {source}")
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slowed down by more than "
+              f"{args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subcommands.add_parser('run', help="run the benchmarks")
+    run_parser.add_argument('--output', default='benchmark-results.json')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--widths',
+                            type=int,
+                            nargs='+',
+                            default=list(DEFAULT_WIDTHS))
+    run_parser.add_argument('--n-colors',
+                            type=_n_colors,
+                            nargs='+',
+                            default=list(DEFAULT_N_COLORS))
+    run_parser.add_argument('--groups',
+                            nargs='+',
+                            choices=('extract', 'mix', 'cluster'),
+                            default=['extract', 'mix', 'cluster'])
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = subcommands.add_parser(
+        'compare', help="compare two result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold',
+                                type=float,
+                                default=0.2,
+                                help="allowed relative slowdown")
+    compare_parser.add_argument('--min-delta',
+                                type=float,
+                                default=0.001,
+                                help="ignore slowdowns below this many seconds")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
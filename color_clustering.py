@@ -0,0 +1,292 @@
+import os
+import threading
+from io import BytesIO
+
+import numpy as np
+
+from flag_cache import atomic_write
+from metrics import span
+from utils import rgb_to_hex_array
+
+# Above this many points the pages switch to large-data mode: mini-batch
+# clustering and a binned scatter plot
+LARGE_DATA_THRESHOLD = 20000
+
+# Most markers drawn in a 3D scatter plot before points are binned
+MAX_PLOT_POINTS = 5000
+
+
+def fit_clusters(points, n_clusters, large=None, random_state=42):
+    """Cluster points, returning (labels, centers).
+
+    Small inputs get a full ``KMeans`` fit. Large ones, by default those
+    over ``LARGE_DATA_THRESHOLD`` points, use ``MiniBatchKMeans``, whose
+    cost per iteration does not grow with the number of points.
+    """
+    if large is None:
+        large = len(points) > LARGE_DATA_THRESHOLD
+    if large:
+        from sklearn.cluster import MiniBatchKMeans
+
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters,
+                                 batch_size=4096,
+                                 n_init=3,
+                                 random_state=random_state)
+    else:
+        from sklearn.cluster import KMeans
+
+        kmeans = KMeans(n_clusters=n_clusters, random_state=random_state)
+    labels = kmeans.fit_predict(points)
+    return labels, kmeans.cluster_centers_
+
+
+def _voxel_keys(rgb, shift):
+    bits = 8 - shift
+    cubes = (rgb >> shift).astype(np.int64)
+    return (cubes[:, 0] << (2 * bits)) | (cubes[:, 1] << bits) | cubes[:, 2]
+
+
+def voxel_bins(rgb, max_points=MAX_PLOT_POINTS):
+    """Bin RGB colors into the smallest cubes that keep the bins few enough.
+
+    Cube edges are powers of two, tried from coarse to fine with one
+    ``bincount`` each, and the finest grid with at most ``max_points``
+    occupied cubes wins, so dense regions keep as much detail as the budget
+    allows. Returns the occupied cubes' mean colors and point counts, the
+    cube index of every input color, and the first input index in each cube
+    (a representative for hover text).
+    """
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    shift = 0 if len(rgb) <= max_points else 7
+    while shift > 1:
+        occupied = np.count_nonzero(
+            np.bincount(_voxel_keys(rgb, shift - 1),
+                        minlength=1 << (3 * (9 - shift))))
+        if occupied > max_points:
+            break
+        shift -= 1
+    # Exact colors would need 2^24 counters, so the last step sorts instead
+    if shift == 1 and len(np.unique(_voxel_keys(rgb, 0))) <= max_points:
+        shift = 0
+    _, first, inverse, counts = np.unique(_voxel_keys(rgb, shift),
+                                          return_index=True,
+                                          return_inverse=True,
+                                          return_counts=True)
+    means = np.stack([
+        np.bincount(inverse, weights=rgb[:, channel]) for channel in range(3)
+    ], axis=1) / counts[:, np.newaxis]
+    return np.rint(means).astype(np.uint8), counts, inverse, first
+
+
+def cluster_members(labels, owners, n_clusters):
+    """Distinct owner ids in each cluster, sorted, from one unique and split.
+
+    ``owners[i]`` is the integer id (e.g. country index) of point i. This
+    replaces a mask and a Python set per cluster with a single pass.
+    """
+    owners = np.asarray(owners, dtype=np.int64)
+    n_owners = int(owners.max(initial=-1)) + 1
+    pairs = np.unique(np.asarray(labels, dtype=np.int64) * n_owners + owners)
+    pair_labels, pair_owners = np.divmod(pairs, max(n_owners, 1))
+    bounds = np.searchsorted(pair_labels, np.arange(n_clusters + 1))
+    return [pair_owners[bounds[i]:bounds[i + 1]] for i in range(n_clusters)]
+
+
+def scatter_figure(rgb, names, title, max_points=MAX_PLOT_POINTS):
+    """3D scatter of colors in RGB space, each marker drawn in its own color.
+
+    Up to ``max_points`` colors are plotted one marker each. Beyond that the
+    colors are binned with ``voxel_bins`` and each occupied cube is one
+    marker, sized by how many colors fell into it, so the figure stays the
+    same size however large the dataset grows.
+    """
+    import plotly.graph_objects as go
+
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    names = np.asarray(names)
+    if len(rgb) <= max_points:
+        points, sizes = rgb, 4
+        hover = names
+    else:
+        points, counts, _, first = voxel_bins(rgb, max_points)
+        sizes = 3 + 2 * np.log2(counts)
+        hover = np.char.add(names[first],
+                            np.char.add(' + ', (counts - 1).astype(str)))
+        hover = np.char.add(hover, ' more')
+    colors = rgb_to_hex_array(points)
+    fig = go.Figure(
+        go.Scatter3d(x=points[:, 0],
+                     y=points[:, 1],
+                     z=points[:, 2],
+                     mode='markers',
+                     marker={
+                         'color': colors,
+                         'size': sizes,
+                         'opacity': 0.9
+                     },
+                     text=hover,
+                     hovertemplate="%{text}<br>%{marker.color}<extra></extra>"))
+    fig.update_layout(title=title,
+                      scene={
+                          'xaxis_title': "Red",
+                          'yaxis_title': "Green",
+                          'zaxis_title': "Blue"
+                      },
+                      margin={
+                          'l': 0,
+                          'r': 0,
+                          'b': 0
+                      })
+    return fig
+
+
+# Cluster counts offered by the pages' slider
+SWEEP_CLUSTERS = range(2, 11)
+# Points sampled for silhouette scores, which cost O(n^2) in full
+SILHOUETTE_SAMPLE = 5000
+
+
+class ClusterSweep:
+    """Clusterings of one point set for every k in ``SWEEP_CLUSTERS``.
+
+    Holds each k's labels and centers, plus its inertia and silhouette score
+    for judging which k fits the data best.
+    """
+
+    def __init__(self, ks, labels, centers, inertia, silhouette):
+        self.ks = list(ks)
+        self.labels = labels
+        self.centers = centers
+        self.inertia = inertia
+        self.silhouette = silhouette
+
+    @classmethod
+    def compute(cls, points, large=None, ks=SWEEP_CLUSTERS):
+        """Fit every k with ``fit_clusters``, so results match a direct fit."""
+        from sklearn.metrics import silhouette_score
+
+        points = np.asarray(points, dtype=np.float64)
+        ks = [k for k in ks if k <= len(points)]
+        labels = np.zeros((len(ks), len(points)), dtype=np.uint8)
+        centers = np.full((len(ks), max(ks, default=0), 3), np.nan)
+        inertia = np.zeros(len(ks))
+        silhouette = np.full(len(ks), np.nan)
+        for i, k in enumerate(ks):
+            with span('cluster.sweep_fit'):
+                labels[i], centers[i, :k] = fit_clusters(points, k, large)
+            inertia[i] = np.sum((points - centers[i, labels[i]])**2)
+            if len(np.unique(labels[i])) > 1 and len(points) > k:
+                silhouette[i] = silhouette_score(
+                    points,
+                    labels[i],
+                    sample_size=min(len(points), SILHOUETTE_SAMPLE),
+                    random_state=42)
+        return cls(ks, labels, centers, inertia, silhouette)
+
+    def result(self, n_clusters):
+        """Return (labels, centers) for one k, as ``fit_clusters`` would."""
+        i = self.ks.index(n_clusters)
+        return self.labels[i], self.centers[i, :n_clusters]
+
+    def save(self, path):
+        buffer = BytesIO()
+        np.savez(buffer,
+                 ks=np.array(self.ks),
+                 labels=self.labels,
+                 centers=self.centers,
+                 inertia=self.inertia,
+                 silhouette=self.silhouette)
+        atomic_write(path, buffer.getvalue())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['ks'].tolist(), data['labels'], data['centers'],
+                       data['inertia'], data['silhouette'])
+
+    def quality_figure(self, selected=None):
+        """Inertia (elbow) and silhouette score across k, on twin axes."""
+        import plotly.graph_objects as go
+
+        fig = go.Figure([
+            go.Scatter(x=self.ks,
+                       y=self.inertia,
+                       name="Inertia",
+                       mode='lines+markers'),
+            go.Scatter(x=self.ks,
+                       y=self.silhouette,
+                       name="Silhouette",
+                       mode='lines+markers',
+                       yaxis='y2')
+        ])
+        fig.update_layout(title="Cluster quality by number of clusters",
+                          xaxis={
+                              'title': "Number of clusters",
+                              'dtick': 1
+                          },
+                          yaxis={'title': "Inertia (lower is tighter)"},
+                          yaxis2={
+                              'title': "Silhouette (higher is better)",
+                              'overlaying': 'y',
+                              'side': 'right'
+                          },
+                          legend={'orientation': 'h'})
+        if selected is not None:
+            fig.add_vline(x=selected, line_dash='dot')
+        return fig
+
+
+_sweeps = {}
+_sweeps_lock = threading.Lock()
+
+
+def _remember_sweep(key, sweep):
+    with _sweeps_lock:
+        # Keys start with the dataset version; older versions are dropped
+        for stale in [other for other in _sweeps if other[1] != key[1]]:
+            del _sweeps[stale]
+        _sweeps[key] = sweep
+
+
+def _compute_sweep(key, points, large, path):
+    sweep = ClusterSweep.compute(points, large)
+    if path is not None:
+        sweep.save(path)
+    _remember_sweep(key, sweep)
+    return sweep
+
+
+def get_cluster_sweep(dataset, kind, points, space, large):
+    """Return the sweep for a dataset's points, or None while it is computed.
+
+    Sweeps are stored in the dataset version's directory, so they survive
+    restarts and are dropped along with the version. A missing sweep is
+    computed once in the background on the shared analysis service;
+    callers fit the requested k directly until it is ready.
+    """
+    from analysis_service import ServiceBusyError, get_analysis_service
+
+    path = None
+    if dataset.directory is not None:
+        method = 'minibatch' if large else 'kmeans'
+        path = os.path.join(dataset.directory,
+                            f'sweep-{kind}-{space}-{method}.npz')
+    key = ('cluster_sweep', dataset.version, kind, space, bool(large))
+    with _sweeps_lock:
+        sweep = _sweeps.get(key)
+    if sweep is not None:
+        return sweep
+    if path is not None and os.path.exists(path):
+        try:
+            sweep = ClusterSweep.load(path)
+        except (OSError, ValueError, KeyError):
+            sweep = None
+        if sweep is not None:
+            _remember_sweep(key, sweep)
+            return sweep
+    try:
+        get_analysis_service().submit(key, _compute_sweep, key,
+                                      np.array(points), large, path)
+    except ServiceBusyError:
+        pass
+    return None
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+from metrics import incr, span
+from utils import file_sha256, flatten_palettes, rgb_to_hex_array
+
+# Bump when the on-disk layout changes so old column sets are rebuilt
+DATASET_FORMAT = 1
+
+_COLUMNS = ('names', 'colors', 'proportions', 'offsets')
+
+
+class ColorDataset:
+    """Flag palettes as flat columns: every palette color back to back.
+
+    ``names[i]`` owns rows ``offsets[i]:offsets[i + 1]`` of ``colors``, an
+    (N, 3) uint8 array, and ``proportions``, float32. Arrays loaded from
+    disk are read-only memory maps, so every session and process reading
+    the same version shares one copy in the page cache.
+    """
+
+    def __init__(self,
+                 names,
+                 colors,
+                 proportions,
+                 offsets,
+                 version=None,
+                 directory=None):
+        self.names = list(names)
+        self.colors = colors
+        self.proportions = proportions
+        self.offsets = offsets
+        self.version = version
+        # Column set directory; derived caches for this version live in it
+        self.directory = directory
+        # Row i of colors belongs to country self.owners[i]
+        self.owners = np.repeat(np.arange(len(self.names)), np.diff(offsets))
+        self._positions = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_country_colors(cls, country_colors, version=None):
+        """Build a dataset from the JSON layout of country_colors.json."""
+        names, colors, proportions, offsets = flatten_palettes(country_colors)
+        return cls(names, colors, proportions.astype(np.float32), offsets,
+                   version)
+
+    def to_country_colors(self):
+        """Return the dataset in the JSON layout, with color names."""
+        from color_names import color_names
+
+        hex_colors = rgb_to_hex_array(self.colors).tolist()
+        proportions = self.proportions.tolist()
+        names = color_names(self.colors)
+        return {
+            name: {
+                'colors': hex_colors[start:end],
+                'proportions': proportions[start:end],
+                'names': names[start:end]
+            }
+            for name, start, end in zip(self.names, self.offsets[:-1].tolist(),
+                                        self.offsets[1:].tolist())
+        }
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def position(self, name):
+        return self._positions[name]
+
+    def palette(self, name):
+        """Return one country's (colors, proportions) array views."""
+        i = self._positions[name]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.colors[start:end], self.proportions[start:end]
+
+    def palette_hex(self, name):
+        """Return one country's palette as a list of hex codes."""
+        return rgb_to_hex_array(self.palette(name)[0]).tolist()
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'names.npy'), np.array(self.names))
+        np.save(os.path.join(directory, 'colors.npy'),
+                np.ascontiguousarray(self.colors, dtype=np.uint8))
+        np.save(os.path.join(directory, 'proportions.npy'),
+                np.ascontiguousarray(self.proportions, dtype=np.float32))
+        np.save(os.path.join(directory, 'offsets.npy'),
+                np.ascontiguousarray(self.offsets, dtype=np.int64))
+
+    @classmethod
+    def load(cls, directory, version=None):
+        columns = {
+            column: np.load(os.path.join(directory, f'{column}.npy'),
+                            mmap_mode='r')
+            for column in _COLUMNS
+        }
+        if len(columns['offsets']) != len(columns['names']) + 1 or \
+                columns['offsets'][-1] != len(columns['colors']):
+            raise ValueError(f"Inconsistent dataset columns in {directory}")
+        return cls(columns['names'].tolist(), columns['colors'],
+                   columns['proportions'], columns['offsets'], version,
+                   directory)
+
+
+def dataset_dir(filename):
+    """Directory holding the column sets built from a JSON dataset."""
+    return os.path.splitext(filename)[0] + '.dataset'
+
+
+def _build(filename, root, version):
+    """Convert the JSON file into a new column set directory named by version.
+
+    The set is written to a temporary directory and renamed into place, so
+    readers never see a partial set; a concurrent builder that wins the
+    rename is kept and this copy discarded.
+    """
+    with open(filename, 'r') as json_file:
+        dataset = ColorDataset.from_country_colors(json.load(json_file),
+                                                   version)
+    os.makedirs(root, exist_ok=True)
+    target = os.path.join(root, version)
+    # Not mkdtemp: its 0700 mode would carry over to the published set
+    staging = os.path.join(root, f'.build-{uuid.uuid4().hex}')
+    os.mkdir(staging)
+    try:
+        dataset.save(staging)
+        os.rename(staging, target)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+    # Old versions may still be mapped by other processes; unlinking their
+    # files is safe, the mappings stay valid until closed
+    for entry in os.listdir(root):
+        if entry != version and not entry.startswith('.build-'):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def get_color_dataset(filename='country_colors.json'):
+    """Return the memory-mapped dataset for a JSON file, shared per process.
+
+    The JSON file is only read to (re)build the column set when its content
+    hash has no set yet. An unchanged file costs one ``stat`` call, so load
+    time does not grow with the dataset.
+    """
+    stat = os.stat(filename)
+    stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    with _datasets_lock:
+        cached = _datasets.get(filename)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with span('dataset.load'):
+            version = f"{file_sha256(filename)[:32]}-v{DATASET_FORMAT}"
+            directory = os.path.join(dataset_dir(filename), version)
+            try:
+                dataset = ColorDataset.load(directory, version)
+            except (OSError, ValueError):
+                incr('dataset.rebuilds')
+                with span('dataset.build'):
+                    _build(filename, dataset_dir(filename), version)
+                dataset = ColorDataset.load(directory, version)
+        _datasets[filename] = (stamp, dataset)
+        return dataset
@@ -0,0 +1,93 @@
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from color_dataset import get_color_dataset
+from utils import hex_to_rgb, mix_palettes, rgb_to_hex
+
+
+class ColorIndex:
+    """Nearest-flag lookup by color over a country colors dataset.
+
+    Two KD-trees are built once: one over every individual palette color and
+    one over each country's weighted mix.
+    """
+
+    def __init__(self, dataset):
+        self.countries = dataset.names
+        self.colors = dataset.colors
+        self.proportions = dataset.proportions
+        # Row i of the palette tree belongs to country self.owners[i]
+        self.owners = dataset.owners
+        self.mixes, _ = mix_palettes(self.colors, dataset.offsets,
+                                     self.proportions)
+        self._palette_tree = cKDTree(self.colors.astype(np.float64))
+        self._mix_tree = cKDTree(self.mixes.astype(np.float64))
+
+    @classmethod
+    def from_file(cls, filename='country_colors.json'):
+        return cls(get_color_dataset(filename))
+
+    def query(self, color, k=5, mode='palette'):
+        """Return the k countries closest to color.
+
+        ``color`` is a hex code or an RGB tuple. With ``mode='palette'`` a
+        country matches on its closest palette color; with ``mode='mix'`` it
+        matches on its weighted mix. Each result holds the country, the RGB
+        distance and the matching color (plus its proportion in palette
+        mode).
+        """
+        if isinstance(color, str):
+            color = hex_to_rgb(color)
+        point = np.asarray(color, dtype=np.float64)
+        k = min(k, len(self.countries))
+        if k <= 0:
+            return []
+
+        if mode == 'mix':
+            distances, indices = self._mix_tree.query(point, k=k)
+            distances, indices = np.atleast_1d(distances, indices)
+            return [{
+                'country': self.countries[i],
+                'distance': float(d),
+                'color': rgb_to_hex(self.mixes[i])
+            } for d, i in zip(distances, indices)]
+        if mode != 'palette':
+            raise ValueError(f"Unknown query mode: {mode}")
+
+        # Countries own several points, so widen the search until k distinct
+        # countries are found
+        n_points = len(self.colors)
+        n_neighbors = min(k * 4, n_points)
+        while True:
+            distances, indices = self._palette_tree.query(point, k=n_neighbors)
+            distances, indices = np.atleast_1d(distances, indices)
+            _, first = np.unique(self.owners[indices], return_index=True)
+            if len(first) >= k or n_neighbors == n_points:
+                break
+            n_neighbors = min(n_neighbors * 4, n_points)
+        first = np.sort(first)[:k]
+        return [{
+            'country': self.countries[self.owners[i]],
+            'distance': float(d),
+            'color': rgb_to_hex(self.colors[i]),
+            'proportion': float(self.proportions[i])
+        } for d, i in zip(distances[first], indices[first])]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_color_index(filename='country_colors.json'):
+    """Return the index for a dataset file, rebuilt when its content changes."""
+    dataset = get_color_dataset(filename)
+    with _indexes_lock:
+        cached = _indexes.get(filename)
+        if cached is not None and cached[0] == dataset.version:
+            return cached[1]
+    index = ColorIndex(dataset)
+    with _indexes_lock:
+        _indexes[filename] = (dataset.version, index)
+    return index
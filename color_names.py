@@ -0,0 +1,82 @@
+import threading
+
+import numpy as np
+
+from color_space import to_space
+from utils import hex_to_rgb_array
+
+
+def named_color_table(spec='css3'):
+    """Return (names, colors) for a webcolors naming spec.
+
+    Names sharing a color (gray and grey, aqua and cyan) are collapsed to
+    the alphabetically first one, so every color has a single name.
+    """
+    import webcolors
+
+    by_hex = {}
+    for name in sorted(webcolors.names(spec)):
+        by_hex.setdefault(webcolors.name_to_hex(name, spec), name)
+    names = list(by_hex.values())
+    return names, hex_to_rgb_array(list(by_hex))
+
+
+class ColorNamer:
+    """Nearest named color for any RGB color, via a KD-tree over the table.
+
+    Distances are measured in ``space``; the default CIELAB matches what
+    people see more closely than RGB does.
+    """
+
+    def __init__(self, space='lab', spec='css3'):
+        from scipy.spatial import cKDTree
+
+        self.space = space
+        names, self.colors = named_color_table(spec)
+        self.names = np.array(names)
+        self._tree = cKDTree(to_space(self.colors, space))
+
+    def name(self, colors):
+        """Return the nearest name of every color in an (N, 3) RGB array."""
+        colors = np.clip(np.asarray(colors).reshape(-1, 3), 0, 255)
+        if not len(colors):
+            return []
+        _, indices = self._tree.query(to_space(colors, self.space))
+        return self.names[indices].tolist()
+
+    def name_hex(self, hex_colors):
+        """Return the nearest name of every hex code in a sequence."""
+        return self.name(hex_to_rgb_array(hex_colors))
+
+
+_namers = {}
+_namers_lock = threading.Lock()
+
+
+def get_color_namer(space='lab'):
+    """Return the process-wide namer for a working space."""
+    with _namers_lock:
+        namer = _namers.get(space)
+        if namer is None:
+            namer = _namers[space] = ColorNamer(space)
+        return namer
+
+
+def color_names(colors, space='lab'):
+    """Name every RGB color in one batched query."""
+    return get_color_namer(space).name(colors)
+
+
+def name_palettes(palettes, space='lab'):
+    """Add a 'names' list to each palette dict holding hex 'colors'.
+
+    Every color of every palette is named in a single batched query.
+    """
+    palettes = list(palettes)
+    names = get_color_namer(space).name_hex(
+        [color for palette in palettes for color in palette['colors']])
+    start = 0
+    for palette in palettes:
+        end = start + len(palette['colors'])
+        palette['names'] = names[start:end]
+        start = end
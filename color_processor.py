@@ -1,64 +1,370 @@
 from PIL import Image
 import numpy as np
-from sklearn.cluster import KMeans
-from collections import Counter
+from color_space import from_space, pack_rgb, to_space, unpack_rgb
+from metrics import incr, span
+from utils import mix_palettes
+
+
+# Bump whenever a change to extraction alters its output, so datasets built
+# by older code are re-extracted on the next incremental rebuild
+EXTRACTION_VERSION = 3
+
+# Cluster centers closer than this (in RGB units) are treated as one color
+DUPLICATE_COLOR_DISTANCE = 12.0
+
+# The blend filter only runs on images of at most this many pixels; in larger
+# ones edges are too small a share to form clusters of their own
+MAX_BLEND_FILTER_PIXELS = 640 * 640
+# Above this share of blend pixels the image is too small or detailed for
+# edges to be told apart from content, and the blend filter is skipped
+MAX_BLEND_SHARE = 0.2
+
+# Automatic palette sizing: largest k tried, and the smallest share of the
+# total variance an extra color must explain to be kept
+MAX_AUTO_COLORS = 10
+AUTO_MIN_GAIN = 0.01
+# Centers fitted past the elbow, so small accents get clusters of their own
+# instead of pulling a chosen color towards them; the merge folds them away
+AUTO_SPARE_COLORS = 3
+
+
+def compress_pixels(pixels):
+    """Collapse an (N, 3) uint8 pixel array into unique colors and counts."""
+    # Pack R,G,B into a single uint32 so one counting pass finds duplicates
+    keys, counts = np.unique(pack_rgb(pixels), return_counts=True)
+    return unpack_rgb(keys), counts
+
+
+def _row_dot(a, b):
+    # Row-wise dot product; einsum avoids a slow reduction over a short axis
+    return np.einsum('ij,ij->i', a, b)
+
+
+def blend_pixel_mask(img_array, tolerance=12.0):
+    """Flag anti-aliased pixels that sit between two different neighbors.
+
+    A pixel counts as a blend when, along the horizontal or vertical axis,
+    it differs from both opposite neighbors and lies close to the line
+    through their colors, slightly overshooting either end to catch the
+    ringing left by resampling filters. Such pixels only exist where
+    resampling mixed two flat regions, so clustering them produces fake
+    in-between colors.
+    """
+    packed = pack_rgb(img_array)
+    height, width = packed.shape
+    padded = np.pad(packed, 1, mode='edge')
+    padded_rgb = np.pad(img_array, ((1, 1), (1, 1), (0, 0)),
+                        mode='edge').reshape(-1, 3)
+    mask = np.zeros(packed.shape, dtype=bool)
+    tol_sq = tolerance * tolerance
+    # Neighbor views, and the step between neighbors in the flat padded image
+    neighbor_pairs = [
+        (padded[1:-1, :-2], padded[1:-1, 2:], 1),  # left / right
+        (padded[:-2, 1:-1], padded[2:, 1:-1], width + 2),  # up / down
+    ]
+    for before, after, step in neighbor_pairs:
+        # Cheap exact test first: flat regions never need the geometry below
+        candidates = np.flatnonzero((packed != before) & (packed != after) &
+                                    (before != after))
+        if not len(candidates):
+            continue
+        rows, cols = np.divmod(candidates, width)
+        positions = (rows + 1) * (width + 2) + cols + 1
+        pixel = padded_rgb[positions].astype(np.float32)
+        start = padded_rgb[positions - step].astype(np.float32)
+        end = padded_rgb[positions + step].astype(np.float32)
+        span = end - start
+        offset = pixel - start
+        remainder = pixel - end
+        span_sq = _row_dot(span, span)
+        t = _row_dot(offset, span) / np.maximum(span_sq, 1)
+        residual = offset - t[:, np.newaxis] * span
+        is_blend = ((span_sq > tol_sq) & (t > -0.5) & (t < 1.5) &
+                    (_row_dot(residual, residual) <= tol_sq) &
+                    (_row_dot(offset, offset) > tol_sq) &
+                    (_row_dot(remainder, remainder) > tol_sq))
+        mask.flat[candidates[is_blend]] = True
+    return mask
+
+
+def nearest_color_indices(colors, centers):
+    """Return the index of the nearest center for every color."""
+    diffs = colors[:, np.newaxis, :] - centers[np.newaxis, :, :]
+    return np.argmin(np.sum(diffs * diffs, axis=2), axis=1)
+
+
+def sweep_palette_size(points,
+                       weights,
+                       max_colors=MAX_AUTO_COLORS,
+                       min_gain=AUTO_MIN_GAIN,
+                       spare_colors=AUTO_SPARE_COLORS):
+    """Choose the number of colors with a warm-started sweep over k.
+
+    Starting from the weighted mean, each step keeps the previous centers
+    and seeds one more at the point contributing most to the inertia, so
+    every fit starts close to convergence. The elbow is the first k whose
+    extra center explains less than ``min_gain`` of the total variance.
+
+    The sweep then goes on for ``spare_colors`` more centers (at most
+    ``max_colors`` in all) and returns those. Without them the pixels of
+    small accents join the nearest chosen color and drag its center off
+    towards a color that is not in the image; with them, the accents form
+    their own clusters, which ``_merge_small_colors`` folds away when they
+    are below ``min_proportion``, just as with a fixed number of colors.
+    """
+    from sklearn.cluster import KMeans
+
+    weights = np.asarray(weights, dtype=np.float64)
+    centers = np.average(points, axis=0, weights=weights)[np.newaxis]
+    sq_distances = np.sum((points - centers[0])**2, axis=1)
+    inertia = total_inertia = np.dot(weights, sq_distances)
+    elbow = None
+    for k in range(2, min(max_colors, len(points)) + 1):
+        if inertia <= 1e-9 * total_inertia:
+            break
+        seed = points[np.argmax(weights * sq_distances)]
+        kmeans = KMeans(n_clusters=k,
+                        init=np.vstack([centers, seed]),
+                        n_init=1)
+        with span('extract.kmeans_fit'):
+            kmeans.fit(points, sample_weight=weights)
+        incr('extract.pixels_clustered', len(points))
+        incr('extract.kmeans_iterations', kmeans.n_iter_)
+        if elbow is None and \
+                (inertia - kmeans.inertia_) / total_inertia < min_gain:
+            elbow = k - 1
+        if elbow is not None and k > elbow + spare_colors:
+            break
+        centers, inertia = kmeans.cluster_centers_, kmeans.inertia_
+        diffs = points[:, np.newaxis, :] - centers[np.newaxis, :, :]
+        sq_distances = np.min(np.sum(diffs * diffs, axis=2), axis=1)
+    return centers
+
+
+def supported_centers(labels, weights, n_centers, min_share):
+    """Mask of the centers holding at least ``min_share`` of the fit weight.
+
+    With blend pixels left out of the fit, a center that owns almost no
+    interior pixels only exists to cover leftover edge pixels; dropping it
+    lets those pixels count towards the flat colors they came from.
+    """
+    support = np.bincount(labels, weights=weights, minlength=n_centers)
+    keep = support >= min_share * support.sum()
+    keep[np.argmax(support)] = True
+    return keep
+
+
+def centers_to_rgb(centers, space='rgb'):
+    """Convert cluster centers from a working space to integer RGB colors."""
+    if space == 'rgb':
+        return centers.astype(int)
+    return np.rint(from_space(centers, space)).astype(int)
 
 
 class ColorProcessor:
 
-    def __init__(self, image):
+    def __init__(self, image, cache=None):
         # Convert image to RGB mode if it isn't already
-        self.image = image.convert('RGB')
+        with span('image.convert'):
+            self.image = image.convert('RGB')
+        # Optional ExtractionCache consulted before running any clustering
+        self.cache = cache
         self.colors = None
         self.proportions = None
 
-    def extract_colors(self, n_colors=5):
-        """Extract main colors from the image using K-means clustering."""
+    def extract_colors(self,
+                       n_colors=5,
+                       algorithm='histogram',
+                       min_proportion=0.01,
+                       edge_filter=True,
+                       space='rgb'):
+        """Extract main colors from the image using K-means clustering.
+
+        With ``algorithm='histogram'`` the image is first collapsed into its
+        unique colors and KMeans runs on those, weighted by pixel count.
+        ``algorithm='kmeans'`` clusters every pixel of the image. Colors
+        covering less than ``min_proportion`` of the image are merged into
+        their closest remaining color.
+
+        With ``edge_filter`` anti-aliased blend pixels are left out of the
+        fit, and colors covering less than ``min_proportion`` of the
+        remaining pixels are dropped; every pixel is still counted towards
+        the nearest extracted color when computing proportions. Images over
+        ``MAX_BLEND_FILTER_PIXELS`` pixels, or where more than
+        ``MAX_BLEND_SHARE`` of the pixels look like blends, are fitted whole.
+
+        ``space`` selects the working color space for clustering: ``'rgb'``,
+        or the perceptual ``'lab'`` (CIELAB) and ``'oklab'``.
+
+        Pass ``n_colors='auto'`` to pick the palette size per image with
+        ``sweep_palette_size`` instead of using a fixed count.
+        """
         # Convert image to numpy array
         img_array = np.array(self.image)
+        if self.cache is not None:
+            cache_key = self.cache.make_key(img_array,
+                                            n_colors=n_colors,
+                                            algorithm=algorithm,
+                                            min_proportion=min_proportion,
+                                            edge_filter=edge_filter,
+                                            space=space,
+                                            version=EXTRACTION_VERSION)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.colors = cached[0].copy()
+                self.proportions = cached[1].copy()
+                return self._valid_colors()
         # Reshape array to 2D, each row is a pixel (R,G,B)
         pixels = img_array.reshape(-1, 3)
-        # Perform K-means clustering
-        kmeans = KMeans(n_clusters=n_colors, random_state=42)
-        kmeans.fit(pixels)
-        # Get colors and their proportions
-        colors = kmeans.cluster_centers_.astype(int)
-        labels = kmeans.labels_
-        # Calculate proportions
-        proportion_count = Counter(labels)
-        total_pixels = sum(proportion_count.values())
-        proportions = [
-            proportion_count[i] / total_pixels for i in range(n_colors)
-        ]
+        fit_pixels = pixels
+        if edge_filter and len(pixels) <= MAX_BLEND_FILTER_PIXELS:
+            with span('extract.edge_filter'):
+                blends = blend_pixel_mask(img_array).reshape(-1)
+                if np.count_nonzero(blends) <= MAX_BLEND_SHARE * len(blends):
+                    fit_pixels = np.compress(~blends, pixels, axis=0)
+        if algorithm == 'histogram':
+            colors, proportions = self._cluster_histogram(
+                pixels, fit_pixels, n_colors, space, min_proportion)
+        elif algorithm == 'kmeans':
+            colors, proportions = self._cluster_pixels(
+                pixels, fit_pixels, n_colors, space, min_proportion)
+        else:
+            raise ValueError(f"Unknown extraction algorithm: {algorithm}")
         # Sort colors by proportion
         sorted_indices = np.argsort(proportions)[::-1]
         self.colors = colors[sorted_indices]
         self.proportions = np.array(proportions)[sorted_indices]
-        # Ignore colors less than 1% and transfer their proportion to the closest color
-        for i in range(len(self.proportions)):
-            if self.proportions[i] < 0.01:
-                closest_index = np.argmin(
-                    np.linalg.norm(self.colors - self.colors[i], axis=1))
-                self.proportions[closest_index] += self.proportions[i]
-                self.proportions[i] = 0  # Set to zero since it's ignored
+        with span('extract.merge'):
+            self._merge_small_colors(min_proportion)
+        if self.cache is not None:
+            self.cache.put(cache_key, self.colors, self.proportions)
+        return self._valid_colors()
+
+    def _merge_small_colors(self, min_proportion):
+        """Fold minor and near-duplicate colors into their closest neighbor."""
+        # Ignore colors less than 1%, or nearly identical to a more common
+        # color, and transfer their proportion to the closest color
+        small = self.proportions < min_proportion
+        distances = np.linalg.norm(self.colors[:, np.newaxis] -
+                                   self.colors[np.newaxis, :],
+                                   axis=2)
+        small |= np.any(np.tril(distances < DUPLICATE_COLOR_DISTANCE, k=-1),
+                        axis=1)
+        small[0] = False  # Always keep the dominant color
+        if small.any():
+            kept = np.flatnonzero(~small)
+            closest = kept[nearest_color_indices(self.colors[small],
+                                                 self.colors[kept])]
+            np.add.at(self.proportions, closest, self.proportions[small])
+            self.proportions[small] = 0  # Set to zero since it's ignored
         # Normalize proportions
         self.proportions /= np.sum(
             self.proportions)  # Ensure proportions sum to 1
-        return self.colors[self.proportions > 0], self.proportions[
-            self.proportions > 0]  # Return valid colors and proportions
+        # Merging can reorder the survivors, so sort once more, and drop the
+        # merged-away rows so mixes and names only see the returned colors
+        sorted_indices = np.argsort(-self.proportions, kind='stable')
+        sorted_indices = sorted_indices[self.proportions[sorted_indices] > 0]
+        self.colors = self.colors[sorted_indices]
+        self.proportions = self.proportions[sorted_indices]
 
-    def get_weighted_mix(self):
+    def _valid_colors(self):
+        """Return the colors and proportions left after merging."""
+        valid = self.proportions > 0
+        return self.colors[valid], self.proportions[valid]
+
+    def _cluster_pixels(self, pixels, fit_pixels, n_colors, space,
+                        min_proportion):
+        """Run K-means over every pixel of the image."""
+        from sklearn.cluster import KMeans
+
+        if n_colors == 'auto':
+            # Size the palette on the compressed set, then refine every pixel
+            # starting from the sweep's centers
+            fit_colors, fit_counts = compress_pixels(fit_pixels)
+            centers = sweep_palette_size(to_space(fit_colors, space),
+                                         fit_counts)
+            n_colors = len(centers)
+            kmeans = KMeans(n_clusters=n_colors, init=centers, n_init=1)
+        else:
+            kmeans = KMeans(n_clusters=n_colors, random_state=42)
+        with span('extract.kmeans_fit'):
+            kmeans.fit(to_space(fit_pixels, space))
+        incr('extract.pixels_clustered', len(fit_pixels))
+        incr('extract.kmeans_iterations', kmeans.n_iter_)
+        centers = kmeans.cluster_centers_
+        if fit_pixels is not pixels:
+            centers = centers[supported_centers(kmeans.labels_, None,
+                                                len(centers), min_proportion)]
+        # Get colors and their proportions, counting each distinct color once
+        colors = centers_to_rgb(centers, space)
+        unique_colors, counts = compress_pixels(pixels)
+        labels = nearest_color_indices(to_space(unique_colors, space), centers)
+        proportions = np.bincount(labels, weights=counts,
+                                  minlength=len(colors)) / counts.sum()
+        return colors, proportions
+
+    def _cluster_histogram(self, pixels, fit_pixels, n_colors, space,
+                           min_proportion):
+        """Run K-means over the unique colors weighted by their pixel counts."""
+        with span('extract.compress'):
+            unique_colors, counts = compress_pixels(pixels)
+            if fit_pixels is pixels:
+                fit_colors, fit_counts = unique_colors, counts
+            else:
+                fit_colors, fit_counts = compress_pixels(fit_pixels)
+        total_pixels = counts.sum()
+        # Few enough distinct colors: the palette is exact, no clustering needed
+        if n_colors != 'auto' and len(fit_colors) <= n_colors:
+            colors = fit_colors
+            centers = to_space(fit_colors, space)
+        elif n_colors == 'auto':
+            centers = sweep_palette_size(to_space(fit_colors, space),
+                                         fit_counts)
+            colors = centers_to_rgb(centers, space)
+        else:
+            from sklearn.cluster import KMeans
+
+            kmeans = KMeans(n_clusters=n_colors, random_state=42)
+            with span('extract.kmeans_fit'):
+                kmeans.fit(to_space(fit_colors, space),
+                           sample_weight=fit_counts)
+            incr('extract.pixels_clustered', len(fit_colors))
+            incr('extract.kmeans_iterations', kmeans.n_iter_)
+            centers = kmeans.cluster_centers_
+            colors = centers_to_rgb(centers, space)
+        if fit_pixels is not pixels:
+            fit_labels = nearest_color_indices(to_space(fit_colors, space),
+                                               centers)
+            keep = supported_centers(fit_labels, fit_counts, len(centers),
+                                     min_proportion)
+            centers, colors = centers[keep], colors[keep]
+        labels = nearest_color_indices(to_space(unique_colors, space), centers)
+        proportions = np.bincount(labels,
+                                  weights=counts,
+                                  minlength=len(colors)) / total_pixels
+        return colors, proportions
+
+    def get_weighted_mix(self, space='rgb'):
         """Calculate weighted mix of colors based on proportions."""
         if self.colors is None or self.proportions is None:
             self.extract_colors()
-        mixed_color = np.sum(self.colors * self.proportions[:, np.newaxis],
-                             axis=0)
-        return tuple(int(round(c)) for c in mixed_color)
+        weighted, _ = mix_palettes(self.colors, [0, len(self.colors)],
+                                   self.proportions, space)
+        return tuple(int(c) for c in weighted[0])
 
-    def get_equal_mix(self):
+    def get_equal_mix(self, space='rgb'):
         """Calculate equal mix of colors."""
         if self.colors is None:
             self.extract_colors()
 
-        mixed_color = np.mean(self.colors, axis=0)
-        return tuple(int(round(c)) for c in mixed_color)
+        _, equal = mix_palettes(self.colors, [0, len(self.colors)],
+                                space=space)
+        return tuple(int(c) for c in equal[0])
+
+    def get_color_names(self, space='lab'):
+        """Name each extracted color after its nearest CSS color."""
+        from color_names import color_names
+
+        if self.colors is None:
+            self.extract_colors()
+        return color_names(self._valid_colors()[0], space)
@@ -0,0 +1,181 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from flag_cache import DEFAULT_CACHE_DIR, _file_mode
+
+# Working spaces accepted by extraction, mixing and clustering
+COLOR_SPACES = ('rgb', 'lab', 'oklab')
+
+# Inputs with at least this many pixels are converted through the lookup
+# table; smaller inputs (unique colors, palettes) use the formulas directly
+TABLE_MIN_PIXELS = 1 << 16
+
+# Bumped whenever the conversion formulas change so stale tables are ignored
+TABLE_VERSION = 1
+
+# sRGB (D65) to CIE XYZ
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+_LAB_DELTA = 6 / 29
+
+# Linear sRGB to OKLab, from Björn Ottosson's reference implementation
+_RGB_TO_LMS = np.array([[0.4122214708, 0.5363325363, 0.0514459929],
+                        [0.2119034982, 0.6806995451, 0.1073969566],
+                        [0.0883024619, 0.2817188376, 0.6299787005]])
+_LMS_TO_OKLAB = np.array([[0.2104542553, 0.7936177850, -0.0040720468],
+                          [1.9779984951, -2.4285922050, 0.4505937099],
+                          [0.0259040371, 0.7827717662, -0.8086757660]])
+_OKLAB_TO_LMS = np.linalg.inv(_LMS_TO_OKLAB)
+_LMS_TO_RGB = np.linalg.inv(_RGB_TO_LMS)
+
+
+def pack_rgb(pixels):
+    """Pack the last (R,G,B) axis of a uint8 array into single uint32 values."""
+    # Shift in place, one channel at a time, to avoid a widened copy of
+    # every channel and the temporaries of a combined expression
+    packed = pixels[..., 0].astype(np.uint32)
+    packed <<= 8
+    packed |= pixels[..., 1].astype(np.uint32)
+    packed <<= 8
+    packed |= pixels[..., 2].astype(np.uint32)
+    return packed
+
+
+def unpack_rgb(packed):
+    """Unpack uint32 values from ``pack_rgb`` into an int64 RGB array."""
+    return np.stack([(packed >> 16) & 0xFF, (packed >> 8) & 0xFF,
+                     packed & 0xFF],
+                    axis=-1).astype(np.int64)
+
+
+def srgb_to_linear(rgb):
+    """Convert 0-255 sRGB values to linear-light 0-1 values."""
+    c = np.asarray(rgb, dtype=np.float64) / 255
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055)**2.4)
+
+
+def linear_to_srgb(linear):
+    """Convert linear-light 0-1 values to 0-255 sRGB, clipped to the gamut."""
+    linear = np.clip(linear, 0, 1)
+    c = np.where(linear <= 0.0031308, linear * 12.92,
+                 1.055 * linear**(1 / 2.4) - 0.055)
+    return c * 255
+
+
+def _rgb_to_lab(rgb):
+    xyz = srgb_to_linear(rgb) @ _RGB_TO_XYZ.T / _D65_WHITE
+    f = np.where(xyz > _LAB_DELTA**3, np.cbrt(xyz),
+                 xyz / (3 * _LAB_DELTA**2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2])
+    ],
+                    axis=-1)
+
+
+def _lab_to_rgb(lab):
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200],
+                 axis=-1)
+    xyz = np.where(f > _LAB_DELTA, f**3,
+                   3 * _LAB_DELTA**2 * (f - 4 / 29)) * _D65_WHITE
+    return linear_to_srgb(xyz @ _XYZ_TO_RGB.T)
+
+
+def _rgb_to_oklab(rgb):
+    lms = np.cbrt(srgb_to_linear(rgb) @ _RGB_TO_LMS.T)
+    return lms @ _LMS_TO_OKLAB.T
+
+
+def _oklab_to_rgb(oklab):
+    lms = (np.asarray(oklab, dtype=np.float64) @ _OKLAB_TO_LMS.T)**3
+    return linear_to_srgb(lms @ _LMS_TO_RGB.T)
+
+
+_FORWARD = {'lab': _rgb_to_lab, 'oklab': _rgb_to_oklab}
+_INVERSE = {'lab': _lab_to_rgb, 'oklab': _oklab_to_rgb}
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def _table_path(space):
+    cache_dir = os.environ.get('FLAG_CACHE_DIR') or DEFAULT_CACHE_DIR
+    return os.path.join(cache_dir, 'tables',
+                        f"srgb-to-{space}-v{TABLE_VERSION}.npy")
+
+
+def _build_table(space, path):
+    """Write the full 2^24-entry conversion table to path in chunks."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        os.fchmod(fd, _file_mode(path))
+        os.close(fd)
+        table = np.lib.format.open_memmap(tmp_path,
+                                          mode='w+',
+                                          dtype=np.float32,
+                                          shape=(1 << 24, 3))
+        chunk = 1 << 20
+        for start in range(0, 1 << 24, chunk):
+            packed = np.arange(start, start + chunk, dtype=np.uint32)
+            table[start:start + chunk] = _FORWARD[space](unpack_rgb(packed))
+        table.flush()
+        del table
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_table(space):
+    """Return the read-only, memory-mapped sRGB lookup table for a space.
+
+    The table holds the converted value of every 24-bit sRGB color, indexed
+    by ``pack_rgb``. It is built once on disk and then shared between
+    processes through the page cache.
+    """
+    with _tables_lock:
+        table = _tables.get(space)
+        if table is None:
+            path = _table_path(space)
+            if not os.path.exists(path):
+                _build_table(space, path)
+            table = np.load(path, mmap_mode='r')
+            _tables[space] = table
+        return table
+
+
+def to_space(rgb, space='rgb', use_table=None):
+    """Convert 0-255 sRGB values with a trailing RGB axis into a working space.
+
+    Large inputs such as whole images are converted with one gather from the
+    lookup table; pass ``use_table`` to force either path.
+    """
+    if space == 'rgb':
+        return np.asarray(rgb, dtype=np.float64)
+    if space not in _FORWARD:
+        raise ValueError(f"Unknown color space: {space}")
+    rgb = np.asarray(rgb)
+    if use_table is None:
+        use_table = rgb.size // 3 >= TABLE_MIN_PIXELS
+    if use_table:
+        return get_table(space)[pack_rgb(rgb)]
+    return _FORWARD[space](rgb)
+
+
+def from_space(values, space='rgb'):
+    """Convert working-space values back to 0-255 sRGB floats."""
+    if space == 'rgb':
+        return np.clip(np.asarray(values, dtype=np.float64), 0, 255)
+    if space not in _INVERSE:
+        raise ValueError(f"Unknown color space: {space}")
+    return _INVERSE[space](values)
@@ -0,0 +1,519 @@
+"""Country registry and ranked fuzzy search over names, codes and aliases.
+
+``COUNTRIES`` holds every ISO 3166-1 country and territory that flagcdn
+serves a flag for, and ``SUBDIVISIONS`` the optional ISO 3166-2 regions it
+also covers. ``DATASET_COUNTRIES`` is the subset that makes up the color
+dataset. The search index is built once per process.
+"""
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from types import MappingProxyType
+
+# ISO 3166-1 alpha-2 code -> display name
+COUNTRIES = {
+    'AD': 'Andorra',
+    'AE': 'United Arab Emirates',
+    'AF': 'Afghanistan',
+    'AG': 'Antigua and Barbuda',
+    'AI': 'Anguilla',
+    'AL': 'Albania',
+    'AM': 'Armenia',
+    'AO': 'Angola',
+    'AQ': 'Antarctica',
+    'AR': 'Argentina',
+    'AS': 'American Samoa',
+    'AT': 'Austria',
+    'AU': 'Australia',
+    'AW': 'Aruba',
+    'AX': 'Åland Islands',
+    'AZ': 'Azerbaijan',
+    'BA': 'Bosnia and Herzegovina',
+    'BB': 'Barbados',
+    'BD': 'Bangladesh',
+    'BE': 'Belgium',
+    'BF': 'Burkina Faso',
+    'BG': 'Bulgaria',
+    'BH': 'Bahrain',
+    'BI': 'Burundi',
+    'BJ': 'Benin',
+    'BL': 'Saint Barthélemy',
+    'BM': 'Bermuda',
+    'BN': 'Brunei',
+    'BO': 'Bolivia',
+    'BQ': 'Caribbean Netherlands',
+    'BR': 'Brazil',
+    'BS': 'Bahamas',
+    'BT': 'Bhutan',
+    'BV': 'Bouvet Island',
+    'BW': 'Botswana',
+    'BY': 'Belarus',
+    'BZ': 'Belize',
+    'CA': 'Canada',
+    'CC': 'Cocos (Keeling) Islands',
+    'CD': 'Democratic Republic of Congo',
+    'CF': 'Central African Republic',
+    'CG': 'Republic of the Congo',
+    'CH': 'Switzerland',
+    'CI': 'Ivory Coast',
+    'CK': 'Cook Islands',
+    'CL': 'Chile',
+    'CM': 'Cameroon',
+    'CN': 'China',
+    'CO': 'Colombia',
+    'CR': 'Costa Rica',
+    'CU': 'Cuba',
+    'CV': 'Cape Verde',
+    'CW': 'Curaçao',
+    'CX': 'Christmas Island',
+    'CY': 'Cyprus',
+    'CZ': 'Czech Republic',
+    'DE': 'Germany',
+    'DJ': 'Djibouti',
+    'DK': 'Denmark',
+    'DM': 'Dominica',
+    'DO': 'Dominican Republic',
+    'DZ': 'Algeria',
+    'EC': 'Ecuador',
+    'EE': 'Estonia',
+    'EG': 'Egypt',
+    'EH': 'Western Sahara',
+    'ER': 'Eritrea',
+    'ES': 'Spain',
+    'ET': 'Ethiopia',
+    'FI': 'Finland',
+    'FJ': 'Fiji',
+    'FK': 'Falkland Islands',
+    'FM': 'Micronesia',
+    'FO': 'Faroe Islands',
+    'FR': 'France',
+    'GA': 'Gabon',
+    'GB': 'United Kingdom',
+    'GD': 'Grenada',
+    'GE': 'Georgia',
+    'GF': 'French Guiana',
+    'GG': 'Guernsey',
+    'GH': 'Ghana',
+    'GI': 'Gibraltar',
+    'GL': 'Greenland',
+    'GM': 'Gambia',
+    'GN': 'Guinea',
+    'GP': 'Guadeloupe',
+    'GQ': 'Equatorial Guinea',
+    'GR': 'Greece',
+    'GS': 'South Georgia and the South Sandwich Islands',
+    'GT': 'Guatemala',
+    'GU': 'Guam',
+    'GW': 'Guinea-Bissau',
+    'GY': 'Guyana',
+    'HK': 'Hong Kong',
+    'HM': 'Heard Island and McDonald Islands',
+    'HN': 'Honduras',
+    'HR': 'Croatia',
+    'HT': 'Haiti',
+    'HU': 'Hungary',
+    'ID': 'Indonesia',
+    'IE': 'Ireland',
+    'IL': 'Israel',
+    'IM': 'Isle of Man',
+    'IN': 'India',
+    'IO': 'British Indian Ocean Territory',
+    'IQ': 'Iraq',
+    'IR': 'Iran',
+    'IS': 'Iceland',
+    'IT': 'Italy',
+    'JE': 'Jersey',
+    'JM': 'Jamaica',
+    'JO': 'Jordan',
+    'JP': 'Japan',
+    'KE': 'Kenya',
+    'KG': 'Kyrgyzstan',
+    'KH': 'Cambodia',
+    'KI': 'Kiribati',
+    'KM': 'Comoros',
+    'KN': 'Saint Kitts and Nevis',
+    'KP': 'North Korea',
+    'KR': 'South Korea',
+    'KW': 'Kuwait',
+    'KY': 'Cayman Islands',
+    'KZ': 'Kazakhstan',
+    'LA': 'Laos',
+    'LB': 'Lebanon',
+    'LC': 'Saint Lucia',
+    'LI': 'Liechtenstein',
+    'LK': 'Sri Lanka',
+    'LR': 'Liberia',
+    'LS': 'Lesotho',
+    'LT': 'Lithuania',
+    'LU': 'Luxembourg',
+    'LV': 'Latvia',
+    'LY': 'Libya',
+    'MA': 'Morocco',
+    'MC': 'Monaco',
+    'MD': 'Moldova',
+    'ME': 'Montenegro',
+    'MF': 'Saint Martin',
+    'MG': 'Madagascar',
+    'MH': 'Marshall Islands',
+    'MK': 'North Macedonia',
+    'ML': 'Mali',
+    'MM': 'Myanmar',
+    'MN': 'Mongolia',
+    'MO': 'Macau',
+    'MP': 'Northern Mariana Islands',
+    'MQ': 'Martinique',
+    'MR': 'Mauritania',
+    'MS': 'Montserrat',
+    'MT': 'Malta',
+    'MU': 'Mauritius',
+    'MV': 'Maldives',
+    'MW': 'Malawi',
+    'MX': 'Mexico',
+    'MY': 'Malaysia',
+    'MZ': 'Mozambique',
+    'NA': 'Namibia',
+    'NC': 'New Caledonia',
+    'NE': 'Niger',
+    'NF': 'Norfolk Island',
+    'NG': 'Nigeria',
+    'NI': 'Nicaragua',
+    'NL': 'Netherlands',
+    'NO': 'Norway',
+    'NP': 'Nepal',
+    'NR': 'Nauru',
+    'NU': 'Niue',
+    'NZ': 'New Zealand',
+    'OM': 'Oman',
+    'PA': 'Panama',
+    'PE': 'Peru',
+    'PF': 'French Polynesia',
+    'PG': 'Papua New Guinea',
+    'PH': 'Philippines',
+    'PK': 'Pakistan',
+    'PL': 'Poland',
+    'PM': 'Saint Pierre and Miquelon',
+    'PN': 'Pitcairn Islands',
+    'PR': 'Puerto Rico',
+    'PS': 'Palestine',
+    'PT': 'Portugal',
+    'PW': 'Palau',
+    'PY': 'Paraguay',
+    'QA': 'Qatar',
+    'RE': 'Réunion',
+    'RO': 'Romania',
+    'RS': 'Serbia',
+    'RU': 'Russia',
+    'RW': 'Rwanda',
+    'SA': 'Saudi Arabia',
+    'SB': 'Solomon Islands',
+    'SC': 'Seychelles',
+    'SD': 'Sudan',
+    'SE': 'Sweden',
+    'SG': 'Singapore',
+    'SH': 'Saint Helena, Ascension and Tristan da Cunha',
+    'SI': 'Slovenia',
+    'SJ': 'Svalbard and Jan Mayen',
+    'SK': 'Slovakia',
+    'SL': 'Sierra Leone',
+    'SM': 'San Marino',
+    'SN': 'Senegal',
+    'SO': 'Somalia',
+    'SR': 'Suriname',
+    'SS': 'South Sudan',
+    'ST': 'São Tomé and Príncipe',
+    'SV': 'El Salvador',
+    'SX': 'Sint Maarten',
+    'SY': 'Syria',
+    'SZ': 'Eswatini',
+    'TC': 'Turks and Caicos Islands',
+    'TD': 'Chad',
+    'TF': 'French Southern and Antarctic Lands',
+    'TG': 'Togo',
+    'TH': 'Thailand',
+    'TJ': 'Tajikistan',
+    'TK': 'Tokelau',
+    'TL': 'Timor-Leste',
+    'TM': 'Turkmenistan',
+    'TN': 'Tunisia',
+    'TO': 'Tonga',
+    'TR': 'Turkey',
+    'TT': 'Trinidad and Tobago',
+    'TV': 'Tuvalu',
+    'TW': 'Taiwan',
+    'TZ': 'Tanzania',
+    'UA': 'Ukraine',
+    'UG': 'Uganda',
+    'UM': 'United States Minor Outlying Islands',
+    'US': 'United States',
+    'UY': 'Uruguay',
+    'UZ': 'Uzbekistan',
+    'VA': 'Vatican City',
+    'VC': 'Saint Vincent and the Grenadines',
+    'VE': 'Venezuela',
+    'VG': 'British Virgin Islands',
+    'VI': 'United States Virgin Islands',
+    'VN': 'Vietnam',
+    'VU': 'Vanuatu',
+    'WF': 'Wallis and Futuna',
+    'WS': 'Samoa',
+    # User-assigned code, not in ISO 3166-1, but served by flagcdn
+    'XK': 'Kosovo',
+    'YE': 'Yemen',
+    'YT': 'Mayotte',
+    'ZA': 'South Africa',
+    'ZM': 'Zambia',
+    'ZW': 'Zimbabwe',
+}
+
+# Countries analyzed into country_colors.json, in dataset order. Rebuilds
+# default to this list so the dataset keeps its scope; searching covers
+# the whole registry
+DATASET_COUNTRIES = (
+    'US', 'GB', 'FR', 'DE', 'JP', 'BR', 'IN', 'CN', 'RU', 'CA', 'AU', 'IT',
+    'ES', 'MX', 'ZA', 'KR', 'NG', 'EG', 'SA', 'AR', 'TR', 'NL', 'SE', 'CH',
+    'NO', 'FI', 'DK', 'PL', 'PT', 'GR', 'BE', 'AT', 'TH', 'VN', 'MY', 'PH',
+    'SG', 'NZ', 'ID', 'IR', 'PK', 'BD', 'UA', 'IL', 'KE', 'GH', 'TZ', 'CO',
+    'VE', 'CL', 'PE', 'CZ', 'HU', 'RO', 'SK', 'BG', 'AE', 'QA', 'KW', 'OM',
+    'BH', 'LK', 'MM', 'KH', 'LA', 'NP', 'ZW', 'ZM', 'MW', 'UG', 'SD', 'DZ',
+    'MA', 'TN', 'ET', 'SN', 'CI', 'ML', 'BF', 'SL', 'GM', 'LR', 'CM', 'CD',
+    'AO', 'MZ', 'BW', 'NA', 'SZ', 'LS', 'BJ', 'TG', 'GA', 'GN', 'TD', 'NE',
+    'ER', 'SO', 'CF', 'RW', 'BI', 'MQ', 'GP', 'RE',
+)
+
+# ISO 3166-2 code -> display name, for subdivisions with their own flag
+SUBDIVISIONS = {
+    'GB-ENG': 'England',
+    'GB-NIR': 'Northern Ireland',
+    'GB-SCT': 'Scotland',
+    'GB-WLS': 'Wales',
+    'US-AL': 'Alabama',
+    'US-AK': 'Alaska',
+    'US-AZ': 'Arizona',
+    'US-AR': 'Arkansas',
+    'US-CA': 'California',
+    'US-CO': 'Colorado',
+    'US-CT': 'Connecticut',
+    'US-DE': 'Delaware',
+    'US-FL': 'Florida',
+    'US-GA': 'Georgia',
+    'US-HI': 'Hawaii',
+    'US-ID': 'Idaho',
+    'US-IL': 'Illinois',
+    'US-IN': 'Indiana',
+    'US-IA': 'Iowa',
+    'US-KS': 'Kansas',
+    'US-KY': 'Kentucky',
+    'US-LA': 'Louisiana',
+    'US-ME': 'Maine',
+    'US-MD': 'Maryland',
+    'US-MA': 'Massachusetts',
+    'US-MI': 'Michigan',
+    'US-MN': 'Minnesota',
+    'US-MS': 'Mississippi',
+    'US-MO': 'Missouri',
+    'US-MT': 'Montana',
+    'US-NE': 'Nebraska',
+    'US-NV': 'Nevada',
+    'US-NH': 'New Hampshire',
+    'US-NJ': 'New Jersey',
+    'US-NM': 'New Mexico',
+    'US-NY': 'New York',
+    'US-NC': 'North Carolina',
+    'US-ND': 'North Dakota',
+    'US-OH': 'Ohio',
+    'US-OK': 'Oklahoma',
+    'US-OR': 'Oregon',
+    'US-PA': 'Pennsylvania',
+    'US-RI': 'Rhode Island',
+    'US-SC': 'South Carolina',
+    'US-SD': 'South Dakota',
+    'US-TN': 'Tennessee',
+    'US-TX': 'Texas',
+    'US-UT': 'Utah',
+    'US-VT': 'Vermont',
+    'US-VA': 'Virginia',
+    'US-WA': 'Washington',
+    'US-WV': 'West Virginia',
+    'US-WI': 'Wisconsin',
+    'US-WY': 'Wyoming',
+}
+
+# Other names people search for: official, former and local names
+ALIASES = {
+    'AE': ('UAE', 'Emirates'),
+    'BO': ('Plurinational State of Bolivia', ),
+    'BN': ('Brunei Darussalam', ),
+    'CD': ('DR Congo', 'DRC', 'Congo-Kinshasa', 'Zaire'),
+    'CG': ('Congo-Brazzaville', 'Congo'),
+    'CI': ("Côte d'Ivoire", ),
+    'CV': ('Cabo Verde', ),
+    'CZ': ('Czechia', ),
+    'DE': ('Deutschland', ),
+    'ES': ('España', ),
+    'FM': ('Federated States of Micronesia', ),
+    'GB': ('UK', 'Great Britain', 'Britain'),
+    'IR': ('Persia', 'Islamic Republic of Iran'),
+    'KP': ("Democratic People's Republic of Korea", 'DPRK'),
+    'KR': ('Republic of Korea', 'Korea'),
+    'LA': ("Lao People's Democratic Republic", ),
+    'MD': ('Republic of Moldova', ),
+    'MK': ('Macedonia', ),
+    'MM': ('Burma', ),
+    'NL': ('Holland', 'The Netherlands'),
+    'PS': ('State of Palestine', ),
+    'RU': ('Russian Federation', ),
+    'SY': ('Syrian Arab Republic', ),
+    'SZ': ('Swaziland', ),
+    'TL': ('East Timor', ),
+    'TR': ('Türkiye', ),
+    'TW': ('Republic of China', ),
+    'TZ': ('United Republic of Tanzania', ),
+    'US': ('USA', 'United States of America', 'America'),
+    'VA': ('Holy See', 'Vatican'),
+    'VE': ('Bolivarian Republic of Venezuela', ),
+    'VN': ('Viet Nam', ),
+}
+
+
+def fold(text):
+    """Normalize text for matching: strip accents, casefold, keep words."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', stripped.casefold()).split())
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CountryIndex:
+    """Prefix and trigram index over country names, codes and aliases.
+
+    Exact codes rank first, then exact names, then names starting with the
+    query, then those with a word starting with it, then fuzzy matches
+    scored by the share of the query's trigrams they contain, which
+    tolerates typos. Aliases rank just below display names.
+    """
+
+    # Smallest trigram overlap that still counts as a fuzzy match
+    MIN_SIMILARITY = 0.6
+    ALIAS_PENALTY = 0.05
+
+    def __init__(self, names, aliases=None):
+        self.names = dict(names)
+        self._codes = {fold(code): code for code in self.names}
+        self._key_codes = []
+        self._keys = []
+        self._penalties = []
+        for code, name in self.names.items():
+            for key in (name, ) + tuple((aliases or {}).get(code, ())):
+                self._keys.append(fold(key))
+                self._key_codes.append(code)
+                self._penalties.append(0 if key == name else
+                                       self.ALIAS_PENALTY)
+        # Sorted (token, key id) pairs: a whole key and each word in it
+        self._prefixes = sorted({(token, i)
+                                 for i, key in enumerate(self._keys)
+                                 for token in [key] + key.split()})
+        self._trigrams = {}
+        for i, key in enumerate(self._keys):
+            for trigram in _trigrams(key):
+                self._trigrams.setdefault(trigram, []).append(i)
+
+    def _prefix_matches(self, query):
+        start = bisect_left(self._prefixes, (query, -1))
+        for token, i in self._prefixes[start:]:
+            if not token.startswith(query):
+                break
+            if token == query == self._keys[i]:
+                score = 0.98
+            elif token == self._keys[i]:
+                score = 0.9
+            else:
+                score = 0.8
+            yield i, score - self._penalties[i]
+
+    def search(self, query, limit=None):
+        """Return (code, name) pairs ranked by how well they match query.
+
+        An empty query lists every entry alphabetically by name.
+        """
+        query = fold(query)
+        if not query:
+            ranked = sorted(self.names.items(), key=lambda item: item[1])
+            return ranked[:limit]
+        scores = {}
+
+        def offer(code, score):
+            if score > scores.get(code, 0):
+                scores[code] = score
+
+        if query in self._codes:
+            offer(self._codes[query], 1.0)
+        for i, score in self._prefix_matches(query):
+            offer(self._key_codes[i], score)
+        query_trigrams = _trigrams(query)
+        hits = Counter()
+        for trigram in query_trigrams:
+            hits.update(self._trigrams.get(trigram, ()))
+        for i, count in hits.items():
+            similarity = count / len(query_trigrams)
+            if similarity >= self.MIN_SIMILARITY:
+                offer(self._key_codes[i],
+                      0.7 * similarity - self._penalties[i])
+        ranked = sorted(scores,
+                        key=lambda code: (-scores[code], self.names[code]))
+        return [(code, self.names[code]) for code in ranked[:limit]]
+
+
+_lock = threading.Lock()
+_dataset_countries = None
+_country_lists = {}
+_indexes = {}
+
+
+def get_country_list():
+    """Return the dataset's countries as a read-only code -> name mapping.
+
+    This is the default scope of dataset rebuilds; see ``all_countries``
+    for the full registry.
+    """
+    global _dataset_countries
+    with _lock:
+        if _dataset_countries is None:
+            _dataset_countries = MappingProxyType(
+                {code: COUNTRIES[code] for code in DATASET_COUNTRIES})
+        return _dataset_countries
+
+
+def all_countries(subdivisions=False):
+    """Return every registry entry as a read-only code -> name mapping.
+
+    Built once per process; ``subdivisions`` adds ISO 3166-2 regions, named
+with their country's code (``Georgia (US)``) to keep names unique.
+    """
+    with _lock:
+        if subdivisions not in _country_lists:
+            names = dict(COUNTRIES)
+            if subdivisions:
+                names.update((code, f"{name} ({code.split('-')[0]})")
+                             for code, name in SUBDIVISIONS.items())
+            _country_lists[subdivisions] = MappingProxyType(names)
+        return _country_lists[subdivisions]
+
+
+def get_country_index(subdivisions=False):
+    """Return the process-wide search index over the whole registry."""
+    names = all_countries(subdivisions)
+    with _lock:
+        if subdivisions not in _indexes:
+            _indexes[subdivisions] = CountryIndex(names, ALIASES)
+        return _indexes[subdivisions]
+
+
+def search_countries(query, limit=None, subdivisions=False):
+    """Ranked fuzzy search over names, codes and aliases; see CountryIndex."""
+    return get_country_index(subdivisions).search(query, limit)
@@ -0,0 +1,45 @@
+import os
+import streamlit as st
+from metrics import metrics
+
+
+def debug_enabled():
+    """Show the debug panel only when the server sets FLAG_DEBUG=1.
+
+    The panel exposes process-wide metrics and can reset them, so visitors
+    must not be able to turn it on from the URL.
+    """
+    return os.environ.get('FLAG_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+
+def render_debug_panel():
+    """Render process-wide timing spans and counters in the sidebar."""
+    if not debug_enabled():
+        return
+    snapshot = metrics.snapshot()
+    with st.sidebar.expander("Debug: timings and counters", expanded=True):
+        span_rows = [{
+            'span': name,
+            'count': stats['count'],
+            'total ms': round(stats['total_s'] * 1000, 2),
+            'mean ms': round(stats['total_s'] * 1000 / stats['count'], 2),
+            'max ms': round(stats['max_s'] * 1000, 2)
+        } for name, stats in sorted(snapshot['spans'].items())]
+        if span_rows:
+            st.dataframe(span_rows, hide_index=True)
+        counter_rows = [{
+            'counter': name,
+            'value': value
+        } for name, value in sorted(snapshot['counters'].items())]
+        if counter_rows:
+            st.dataframe(counter_rows, hide_index=True)
+        st.download_button(label="Prometheus metrics",
+                           data=metrics.to_prometheus(),
+                           file_name="flags_metrics.prom",
+                           mime="text/plain")
+        st.download_button(label="JSONL event log",
+                           data=metrics.to_jsonl(),
+                           file_name="flags_metrics.jsonl",
+                           mime="application/jsonl")
+        if st.button("Reset metrics"):
+            metrics.reset()
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import threading
+from io import BytesIO
+
+import numpy as np
+from cachetools import LRUCache
+
+from flag_cache import atomic_write
+from metrics import incr
+
+
+def _frozen(array):
+    array = np.array(array)
+    array.setflags(write=False)
+    return array
+
+
+class ExtractionCache:
+    """Two-tier cache of ``ColorProcessor`` results.
+
+    Entries are keyed by a hash of the decoded pixels together with the
+    extraction parameters. A bounded in-memory LRU sits in front of an
+    optional directory of ``.npz`` files that survives restarts.
+    """
+
+    def __init__(self, maxsize=256, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._memory = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(img_array, **params):
+        """Hash an image array and the extraction parameters into a key."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(str(img_array.shape).encode())
+        digest.update(np.ascontiguousarray(img_array).data)
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        """Return cached ``(colors, proportions)`` arrays, or None on a miss."""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None:
+            incr('extraction_cache.memory_hits')
+            return entry
+        if self.cache_dir is None:
+            incr('extraction_cache.misses')
+            return None
+        try:
+            with np.load(self._disk_path(key)) as data:
+                entry = (_frozen(data['colors']), _frozen(data['proportions']))
+        except (OSError, ValueError, KeyError):
+            incr('extraction_cache.misses')
+            return None
+        incr('extraction_cache.disk_hits')
+        with self._lock:
+            self._memory[key] = entry
+        return entry
+
+    def put(self, key, colors, proportions):
+        """Store extraction results under key in every tier."""
+        entry = (_frozen(colors), _frozen(proportions))
+        with self._lock:
+            self._memory[key] = entry
+        if self.cache_dir is not None:
+            buffer = BytesIO()
+            np.savez(buffer, colors=entry[0], proportions=entry[1])
+            atomic_write(self._disk_path(key), buffer.getvalue())
+        return entry
+
+    def clear(self):
+        """Drop all in-memory entries; files on disk are kept."""
+        with self._lock:
+            self._memory.clear()
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """Return the process-wide extraction cache shared by all sessions.
+
+    The on-disk tier is enabled when ``FLAG_EXTRACTION_CACHE_DIR`` is set.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ExtractionCache(
+                cache_dir=os.environ.get('FLAG_EXTRACTION_CACHE_DIR'))
+        return _shared_cache
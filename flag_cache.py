@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from cachetools import LRUCache
+from PIL import Image
+
+from http_client import REQUEST_TIMEOUT, get_http_client
+from metrics import incr, span
+
+FLAG_URL_TEMPLATE = "https://flagcdn.com/w{width}/{code}.png"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'flags')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class FlagNotCachedError(LookupError):
+    """Raised in offline mode when a flag has never been downloaded."""
+
+
+class InvalidFlagError(ValueError):
+    """Raised when the CDN answers with something that is not a PNG."""
+
+
+def _env_flag(name):
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _umask():
+    """Return the process umask without changing it where possible."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    # Elsewhere the umask can only be read by setting it
+    umask = os.umask(0o077)
+    os.umask(umask)
+    return umask
+
+
+def _file_mode(path):
+    """Mode for a rewritten file: the existing file's, else the umask default.
+
+    ``mkstemp`` always creates 0600 files, so without this every atomically
+    written file would end up private to its owner.
+    """
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        return 0o666 & ~_umask()
+
+
+def atomic_write(path, data):
+    """Write bytes to path so readers never see a partial file."""
+    directory = os.path.dirname(path) or os.curdir
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+            os.fchmod(tmp_file.fileno(), _file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class FlagCache:
+    """Content-addressed on-disk cache of flag PNGs with an in-memory LRU.
+
+    PNG bytes are stored once under ``objects/`` by their SHA-256 digest and
+    each (country code, width) pair has a small JSON ref under ``refs/``
+    holding the digest plus the ETag/Last-Modified validators used to
+    revalidate the entry with a conditional request.
+
+    Downloads go through ``client``, by default the shared pooled and
+    retrying ``HttpClient``. ``FLAG_URL_TEMPLATE`` in the environment points
+    the cache at another server, such as a local mock of flagcdn.
+    """
+
+    def __init__(self,
+                 cache_dir=None,
+                 offline=None,
+                 url_template=None,
+                 timeout=REQUEST_TIMEOUT,
+                 memory_size=128,
+                 client=None):
+        self.cache_dir = (cache_dir or os.environ.get('FLAG_CACHE_DIR')
+                          or DEFAULT_CACHE_DIR)
+        self.offline = _env_flag('FLAG_OFFLINE') if offline is None else offline
+        self.url_template = (url_template or
+                             os.environ.get('FLAG_URL_TEMPLATE') or
+                             FLAG_URL_TEMPLATE)
+        self.timeout = timeout
+        self._client = client
+        self._images = LRUCache(maxsize=memory_size)
+        self._lock = threading.Lock()
+
+    def _ref_path(self, country_code, width):
+        return os.path.join(self.cache_dir, 'refs',
+                            f"{country_code.lower()}-w{width}.json")
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest[:2],
+                            f"{digest}.png")
+
+    def metadata(self, country_code, width=640):
+        """Return the cached ref for a flag, or None if it was never fetched."""
+        try:
+            with open(self._ref_path(country_code, width), 'r') as ref_file:
+                return json.load(ref_file)
+        except (OSError, ValueError):
+            return None
+
+    def _read_cached(self, ref):
+        if ref is None:
+            return None
+        try:
+            with open(self._object_path(ref['sha256']), 'rb') as blob:
+                return blob.read()
+        except OSError:
+            return None
+
+    def _store(self, country_code, width, url, content, response):
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            atomic_write(object_path, content)
+        ref = {
+            'url': url,
+            'sha256': digest,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        atomic_write(self._ref_path(country_code, width),
+                     json.dumps(ref).encode())
+        return ref
+
+    def fetch(self, country_code, width=640):
+        """Return the raw PNG bytes for a flag, revalidating the disk copy."""
+        with span('flag.fetch'):
+            return self._fetch(country_code, width)
+
+    def _fetch(self, country_code, width):
+        ref = self.metadata(country_code, width)
+        cached = self._read_cached(ref)
+        if self.offline:
+            if cached is None:
+                raise FlagNotCachedError(
+                    f"No cached flag for {country_code} at width {width}")
+            incr('flag_cache.disk_hits')
+            return cached
+
+        # Deferred so offline and cached-only processes never load requests
+        import requests
+
+        url = self.url_template.format(width=width, code=country_code.lower())
+        headers = {}
+        if cached is not None:
+            if ref.get('etag'):
+                headers['If-None-Match'] = ref['etag']
+            if ref.get('last_modified'):
+                headers['If-Modified-Since'] = ref['last_modified']
+        client = self._client or get_http_client()
+        try:
+            response = client.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code != 304 or cached is None:
+                response.raise_for_status()
+                if not response.content.startswith(PNG_SIGNATURE):
+                    incr('flag_cache.invalid_responses')
+                    raise InvalidFlagError(f"{url} did not return a PNG")
+        except (requests.RequestException, InvalidFlagError):
+            # Serve a stale copy rather than failing when the CDN misbehaves
+            if cached is not None:
+                incr('flag_cache.stale_served')
+                return cached
+            raise
+        if response.status_code == 304 and cached is not None:
+            ref['fetched_at'] = time.time()
+            atomic_write(self._ref_path(country_code, width),
+                         json.dumps(ref).encode())
+            incr('flag_cache.revalidated')
+            return cached
+        incr('flag_cache.downloads')
+        incr('flag_cache.bytes_downloaded', len(response.content))
+        self._store(country_code, width, url, response.content, response)
+        return response.content
+
+    def get_image(self, country_code, width=640):
+        """Return the decoded flag image, served from memory when possible."""
+        key = (country_code.lower(), width)
+        with self._lock:
+            image = self._images.get(key)
+        if image is not None:
+            incr('flag_cache.memory_hits')
+            return image
+        content = self.fetch(country_code, width)
+        with span('flag.decode'):
+            image = Image.open(BytesIO(content))
+            image.load()
+        with self._lock:
+            self._images[key] = image
+        return image
+
+    def clear_memory(self):
+        """Drop all decoded images held in memory."""
+        with self._lock:
+            self._images.clear()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Return the process-wide flag cache."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = FlagCache()
+        return _default_cache
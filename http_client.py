@@ -0,0 +1,114 @@
+import os
+import threading
+
+from metrics import incr, span
+
+# Connect and read timeouts in seconds for every request
+REQUEST_TIMEOUT = (3.05, 10)
+POOL_SIZE = 16
+MAX_CONCURRENT_REQUESTS = 8
+MAX_ATTEMPTS = 4
+# Statuses worth retrying: rate limiting and transient server failures
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+def _is_transient(error):
+    import requests
+
+    if isinstance(error, requests.HTTPError):
+        return (error.response is not None
+                and error.response.status_code in RETRY_STATUSES)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class HttpClient:
+    """Shared HTTP session with pooling, timeouts, retries and a rate cap.
+
+    One ``requests.Session`` keeps connections alive across calls, and its
+    pool is sized for the number of concurrent requests. Connection errors,
+    timeouts and ``RETRY_STATUSES`` are retried up to ``max_attempts``
+    times with jittered exponential backoff. At most ``max_concurrent``
+    requests are in flight at once across all threads.
+    """
+
+    def __init__(self,
+                 pool_size=POOL_SIZE,
+                 max_concurrent=MAX_CONCURRENT_REQUESTS,
+                 timeout=REQUEST_TIMEOUT,
+                 max_attempts=MAX_ATTEMPTS,
+                 backoff=0.25,
+                 max_backoff=4.0):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        # Retries are handled here, not by urllib3, so they share the limiter
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=pool_size,
+                              max_retries=0,
+                              pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def get(self, url, headers=None, timeout=None):
+        """GET url, retrying transient failures; returns the final response.
+
+        Responses with a retryable status that persists through every
+        attempt raise ``requests.HTTPError``; other statuses are returned
+        for the caller to handle.
+        """
+        from tenacity import (Retrying, retry_if_exception,
+                              stop_after_attempt, wait_random_exponential)
+
+        retrying = Retrying(stop=stop_after_attempt(self.max_attempts),
+                            wait=wait_random_exponential(
+                                multiplier=self.backoff, max=self.max_backoff),
+                            retry=retry_if_exception(_is_transient),
+                            before_sleep=lambda state: incr('http.retries'),
+                            reraise=True)
+        return retrying(self._get_once, url, headers, timeout or self.timeout)
+
+    def _get_once(self, url, headers, timeout):
+        import requests
+
+        with self._slots, span('http.request'):
+            try:
+                response = self.session.get(url,
+                                            headers=headers,
+                                            timeout=timeout)
+            except requests.RequestException:
+                incr('http.errors')
+                raise
+        incr('http.requests')
+        if response.status_code in RETRY_STATUSES:
+            incr('http.errors')
+            raise requests.HTTPError(
+                f"{response.status_code} response from {url}",
+                response=response)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """Return the process-wide HTTP client.
+
+    ``FLAG_MAX_CONCURRENT_REQUESTS`` overrides the concurrency limit.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient(max_concurrent=int(
+                os.environ.get('FLAG_MAX_CONCURRENT_REQUESTS',
+                               MAX_CONCURRENT_REQUESTS)))
+        return _default_client
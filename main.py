@@ -1,13 +1,19 @@
 import streamlit as st
-import plotly.graph_objects as go
-from utils import get_flag_image, rgb_to_hex, get_country_list
-from color_processor import ColorProcessor
+from utils import rgb_to_hex
+from countries import search_countries
+from analysis_service import ServiceBusyError, get_analysis_service
+from color_names import color_names, get_color_namer
+from batch import rebuild_country_colors
+from metrics import span
+from debug_panel import render_debug_panel
+from palette_store import OWNER_RETENTION_DAYS, get_palette_store
+import streamlit.components.v1 as components
 import json
-from datetime import datetime
 import base64
+import re
+import tempfile
 import urllib.parse
-import numpy as np
-from sklearn.cluster import KMeans
+import uuid
 
 # Page configuration
 st.set_page_config(
@@ -21,28 +27,54 @@ st.set_page_config(
         "# Flag Color Analyzer\nAnalyze and share flag color palettes!"
     })
 
-# Initialize session state for saved palettes
-if 'saved_palettes' not in st.session_state:
-    st.session_state.saved_palettes = []
+# Saved palettes per sidebar page
+PALETTES_PER_PAGE = 10
 
+# Longest wait for the shared analysis service, in seconds
+ANALYSIS_TIMEOUT = 60
 
-# Function to save country colors to a JSON file
-def save_country_colors_to_json(filename='country_colors.json'):
-    countries = get_country_list()
-    country_colors = {}
-    for country_code, country_name in countries.items():
-        flag_image = get_flag_image(country_code)
-        processor = ColorProcessor(flag_image)
-        colors, proportions = processor.extract_colors()
-        country_colors[country_name] = {
-            'colors': [rgb_to_hex(color) for color in colors],
-            'proportions': proportions.tolist()
-        }
+# Cookie carrying the palette owner id across sessions
+OWNER_COOKIE = 'flag_palette_owner'
+
+
+def palette_owner():
+    """Return the owner id under which this browser's palettes are saved.
 
-    with open(filename, 'w') as json_file:
-        json.dump(country_colors, json_file, indent=2)
+    The id is the only key to a user's palettes, so it is kept in session
+    state and a cookie, never in the URL, where shared or bookmarked links
+    would hand it to others. Streamlit can only read cookies, so the cookie
+    is (re)set by a small script once per session, which also renews its
+    expiry.
+    """
+    owner = st.session_state.get('owner')
+    if owner is None:
+        owner = st.context.cookies.get(OWNER_COOKIE, '')
+        if not re.fullmatch(r'[0-9a-f]{32}', owner):
+            owner = uuid.uuid4().hex
+        max_age = OWNER_RETENTION_DAYS * 24 * 60 * 60
+        components.html(
+            f"<script>document.cookie = '{OWNER_COOKIE}={owner}; "
+            f"max-age={max_age}; path=/; SameSite=Strict';</script>",
+            height=0)
+        st.session_state.owner = owner
+    return owner
 
-    st.success(f"Saved country colors to {filename}")
+
+# Owner ids used to live in the URL; drop them from old bookmarks
+st.query_params.pop('owner', None)
+palette_owner()
+if 'palette_page' not in st.session_state:
+    st.session_state.palette_page = 0
+
+
+# Function to save country colors to a JSON file
+def save_country_colors_to_json(filename='country_colors.json'):
+    country_colors, failures = rebuild_country_colors(filename)
+    if failures:
+        st.warning(f"Could not process {', '.join(sorted(failures))}; "
+                   "run again to resume from the checkpoint.")
+    else:
+        st.success(f"Saved country colors to {filename}")
     return country_colors
 
 
@@ -78,61 +110,108 @@ st.markdown("""
             unsafe_allow_html=True)
 
 
-def create_color_visualization(colors, proportions, title):
+def create_color_visualization(colors, proportions, title, names):
     """Create a pie chart visualization of colors."""
+    import plotly.graph_objects as go
+
     fig = go.Figure(data=[
         go.Pie(labels=[rgb_to_hex(color) for color in colors],
                values=proportions,
+               customdata=names,
                marker=dict(colors=[rgb_to_hex(color) for color in colors]),
-               hovertemplate=
-               "Color: %{label}<br>Proportion: %{percent}<extra></extra>",
+               hovertemplate="Color: %{label} (%{customdata})<br>"
+               "Proportion: %{percent}<extra></extra>",
                textinfo='percent')
     ])
 
+    # No Plotly template: Streamlit applies its own theme, and the bare
+    # spec stays small and quick to validate when served from the cache
     fig.update_layout(title=title,
                       showlegend=True,
                       height=300,
-                      margin=dict(t=30, b=0, l=0, r=0))
+                      margin=dict(t=30, b=0, l=0, r=0),
+                      template=None)
 
     return fig
 
 
-def save_palette(country_name, colors, proportions):
-    """Save current color palette to session state."""
-    palette = {
-        'country': country_name,
-        'colors': [rgb_to_hex(color) for color in colors],
-        'proportions': proportions.tolist(),
-        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+@st.cache_data(show_spinner=False, max_entries=256)
+def analyze_country(country_code):
+    """Fetch and analyze one flag; every artifact is cached per country.
+
+    The work runs on the process-wide analysis service, so sessions asking
+    for the same flag at once share one computation. Figures are kept as
+    serialized Plotly JSON, so reruns that only touch the palette widgets
+    never fetch, cluster or build charts again.
+    """
+    with span('page.analysis'):
+        analysis = get_analysis_service().analyze_flag(country_code).result(
+            timeout=ANALYSIS_TIMEOUT)
+    colors, proportions = analysis['colors'], analysis['proportions']
+    names = analysis['color_names']
+    equal_proportions = [1 / len(colors)] * len(colors)
+    with span('page.figure'):
+        proportion_figure = create_color_visualization(
+            colors, proportions, "Color Proportions", names).to_json()
+        equal_figure = create_color_visualization(
+            colors, equal_proportions, "Equal Distribution", names).to_json()
+    weighted_name, equal_name = color_names(
+        [analysis['weighted_mix'], analysis['equal_mix']])
+    return {
+        'flag_png': analysis['flag_png'],
+        'colors': colors,
+        'proportions': proportions,
+        'color_names': names,
+        'weighted_hex': rgb_to_hex(analysis['weighted_mix']),
+        'weighted_name': weighted_name,
+        'equal_hex': rgb_to_hex(analysis['equal_mix']),
+        'equal_name': equal_name,
+        'proportion_figure': proportion_figure,
+        'equal_figure': equal_figure
     }
-    st.session_state.saved_palettes.append(palette)
-    return palette
+
+
+def save_palette(country_name, colors, proportions):
+    """Save current color palette to the palette store."""
+    return get_palette_store().add(palette_owner(), country_name,
+                                   [rgb_to_hex(color) for color in colors],
+                                   proportions.tolist())
 
 
 def export_palettes():
-    """Export saved palettes as JSON."""
-    if st.session_state.saved_palettes:
-        export_data = {
-            'palettes': st.session_state.saved_palettes,
-            'exported_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-        return json.dumps(export_data, indent=2)
-    return None
+    """Export saved palettes as a JSON file, streamed from the palette store.
+
+    Chunks are written to an unbuffered temporary file as they are produced,
+    so the export is never assembled as one string; ``st.download_button``
+    reads the file object directly.
+    """
+    store = get_palette_store()
+    owner = palette_owner()
+    if not store.count(owner):
+        return None
+    export_file = tempfile.TemporaryFile(buffering=0)
+    for chunk in store.export_json(owner):
+        export_file.write(chunk.encode())
+    export_file.seek(0)
+    return export_file
 
 
 def create_share_links(palette):
     """Create social media share links for a palette."""
-    # Create a shareable text
+    # Create a shareable text, naming each color after its nearest CSS color
     palette_text = f"Check out the colors of the {palette['country']} flag! "
-    colors_text = " ".join(palette['colors'])
+    names = get_color_namer().name_hex(palette['colors'])
+    colors_text = ", ".join(
+        f"{color} ({name})" for color, name in zip(palette['colors'], names))
     share_text = urllib.parse.quote(
         f"{palette_text}\nColors: {colors_text}\n#FlagColors #Vexillology")
 
     # Base URL (replace with your actual deployed URL)
     base_url = "https://colorflagmix.yourdomain.com"
-    # Encode palette data for URL
+    # Encode palette data for URL, leaving out the internal store row id
+    shared = {key: value for key, value in palette.items() if key != 'id'}
     palette_data = base64.urlsafe_b64encode(
-        json.dumps(palette).encode()).decode()
+        json.dumps(shared).encode()).decode()
     share_url = urllib.parse.quote(f"{base_url}?palette={palette_data}")
 
     # Create social media share links
@@ -165,6 +244,169 @@ def display_share_buttons(share_links):
                 unsafe_allow_html=True)
 
 
+def turn_palette_page(step):
+    st.session_state.palette_page += step
+
+
+@st.fragment
+def saved_palettes_sidebar():
+    """Saved palettes list; paging and removal rerun only this fragment.
+
+    Both act through button callbacks, which run before the fragment
+    renders again, so no explicit rerun is needed.
+    """
+    st.header("Saved Palettes")
+    if st.button("Export All Palettes"):
+        export_file = export_palettes()
+        if export_file is not None:
+            with export_file:
+                st.download_button(label="Download Palettes (JSON)",
+                                   data=export_file,
+                                   file_name="flag_palettes.json",
+                                   mime="application/json")
+
+    # Display one page of saved palettes; only these are rendered
+    store = get_palette_store()
+    owner = palette_owner()
+    n_pages = max(1, -(-store.count(owner) // PALETTES_PER_PAGE))
+    page = st.session_state.palette_page = min(st.session_state.palette_page,
+                                               n_pages - 1)
+    if n_pages > 1:
+        prev_col, label_col, next_col = st.columns([1, 2, 1])
+        prev_col.button("◀",
+                        disabled=page == 0,
+                        on_click=turn_palette_page,
+                        args=(-1, ))
+        label_col.markdown(f"Page {page + 1} of {n_pages}")
+        next_col.button("▶",
+                        disabled=page == n_pages - 1,
+                        on_click=turn_palette_page,
+                        args=(1, ))
+    for palette in store.page(owner, page * PALETTES_PER_PAGE,
+                              PALETTES_PER_PAGE):
+        with st.container():
+            st.markdown(f"### {palette['country']}")
+            st.markdown(f"Saved on: {palette['timestamp']}")
+            colors_html = "".join([
+                f'<span class="color-box" style="background-color: {color}"></span>'
+                for color in palette['colors']
+            ])
+            st.markdown(f"<div class='saved-palette'>{colors_html}</div>",
+                        unsafe_allow_html=True)
+
+            # Add share buttons for each saved palette
+            share_links = create_share_links(palette)
+            display_share_buttons(share_links)
+
+            st.button(f"Remove",
+                      key=f"remove_{palette['id']}",
+                      on_click=store.remove,
+                      args=(owner, palette['id']))
+
+
+@st.fragment
+def palette_actions(country_name, colors, proportions):
+    """Save button for the analyzed palette."""
+    if st.button("Save This Palette"):
+        st.session_state.just_saved = save_palette(country_name, colors,
+                                                   proportions)
+        # The sidebar must list the new palette, so rerun the whole app;
+        # the analysis itself is served from the per-country cache
+        st.rerun(scope="app")
+
+    palette = st.session_state.pop('just_saved', None)
+    if palette is not None:
+        st.success("Palette saved! Check the sidebar to view saved palettes.")
+
+        # Show share buttons for the newly saved palette
+        share_links = create_share_links(palette)
+        st.markdown("### Share this palette")
+        display_share_buttons(share_links)
+
+
+@st.fragment
+def country_analysis():
+    """Country search and analysis; selecting a country reruns only this."""
+    search_term = st.text_input("Search country:", "",
+                                help="Name, alias or ISO code")
+    include_regions = st.checkbox("Include regions (US states, UK nations)")
+
+    # Best matches first; with no search, everything alphabetically
+    filtered_countries = dict(
+        search_countries(search_term, subdivisions=include_regions))
+    options = list(filtered_countries.keys())
+
+    selected_country = st.selectbox(
+        "Select a country:",
+        options=options,
+        index=options.index('US') if not search_term and 'US' in options else 0,
+        format_func=lambda x: filtered_countries[x])
+
+    if not selected_country:
+        return
+    try:
+        analysis = analyze_country(selected_country)
+    except (ServiceBusyError, TimeoutError):
+        st.warning("The analyzer is busy right now; please try again.")
+        return
+    except (OSError, LookupError, ValueError) as e:
+        st.error(f"Could not load the flag: {e}")
+        return
+    colors, proportions = analysis['colors'], analysis['proportions']
+
+    # Load and display flag
+    col1, col2 = st.columns([1, 2])
+
+    with col1:
+        st.image(analysis['flag_png'],
+                 caption=f"Flag of {filtered_countries[selected_country]}")
+
+    with col2:
+        st.subheader("Color Analysis")
+
+        # Display individual colors
+        for color, name, prop in zip(colors, analysis['color_names'],
+                                     proportions):
+            hex_color = rgb_to_hex(color)
+            st.markdown(
+                f'<div><span class="color-box" style="background-color: {hex_color}"></span>'
+                f'{hex_color} {name} ({prop:.1%})</div>',
+                unsafe_allow_html=True)
+
+        # Add save palette button
+        palette_actions(filtered_countries[selected_country], colors,
+                        proportions)
+
+    # Color mixing visualizations
+    st.subheader("Color Mixing Visualizations")
+
+    col3, col4 = st.columns(2)
+
+    with col3:
+        # Weighted mix visualization
+        weighted_hex = analysis['weighted_hex']
+        st.markdown(
+            f"### Weighted Mix\n"
+            f'<div style="background-color: {weighted_hex}; padding: 20px; '
+            f'text-align: center; color: white; margin: 10px 0;">'
+            f'{weighted_hex} ({analysis["weighted_name"]})</div>',
+            unsafe_allow_html=True)
+        st.plotly_chart(json.loads(analysis['proportion_figure']),
+                        use_container_width=True)
+
+    with col4:
+        # Equal mix visualization
+        equal_hex = analysis['equal_hex']
+        st.markdown(
+            f"### Equal Mix\n"
+            f'<div style="background-color: {equal_hex}; padding: 20px; '
+            f'text-align: center; color: white; margin: 10px 0;">'
+            f'{equal_hex} ({analysis["equal_name"]})</div>',
+            unsafe_allow_html=True)
+        st.plotly_chart(json.loads(analysis['equal_figure']),
+                        use_container_width=True)
+
+
 def main():
     st.title("🎨 Flag Color Analyzer")
     st.markdown("""
@@ -200,120 +442,12 @@ def main():
         except Exception as e:
             st.error("Error loading shared palette")
 
-    # Create sidebar for saved palettes
     with st.sidebar:
-        st.header("Saved Palettes")
-        if st.button("Export All Palettes"):
-            export_data = export_palettes()
-            if export_data:
-                st.download_button(label="Download Palettes (JSON)",
-                                   data=export_data,
-                                   file_name="flag_palettes.json",
-                                   mime="application/json")
-
-        # Display saved palettes
-        for idx, palette in enumerate(st.session_state.saved_palettes):
-            with st.container():
-                st.markdown(f"### {palette['country']}")
-                st.markdown(f"Saved on: {palette['timestamp']}")
-                colors_html = "".join([
-                    f'<span class="color-box" style="background-color: {color}"></span>'
-                    for color in palette['colors']
-                ])
-                st.markdown(f"<div class='saved-palette'>{colors_html}</div>",
-                            unsafe_allow_html=True)
-
-                # Add share buttons for each saved palette
-                share_links = create_share_links(palette)
-                display_share_buttons(share_links)
-
-                if st.button(f"Remove", key=f"remove_{idx}"):
-                    st.session_state.saved_palettes.pop(idx)
-                    st.rerun()
-
-    # Country selection
-    countries = get_country_list()
-    search_term = st.text_input("Search country:", "")
-
-    filtered_countries = {
-        code: name
-        for code, name in countries.items()
-        if search_term.lower() in name.lower()
-    }
+        saved_palettes_sidebar()
 
-    selected_country = st.selectbox(
-        "Select a country:",
-        options=list(filtered_countries.keys()),
-        format_func=lambda x: filtered_countries[x])
+    country_analysis()
 
-    if selected_country:
-        # Load and display flag
-        col1, col2 = st.columns([1, 2])
-
-        with col1:
-            flag_image = get_flag_image(selected_country)
-            st.image(flag_image,
-                     caption=f"Flag of {filtered_countries[selected_country]}")
-
-        # Process colors
-        processor = ColorProcessor(flag_image)
-        colors, proportions = processor.extract_colors()
-
-        with col2:
-            st.subheader("Color Analysis")
-
-            # Display individual colors
-            for color, prop in zip(colors, proportions):
-                hex_color = rgb_to_hex(color)
-                st.markdown(
-                    f'<div><span class="color-box" style="background-color: {hex_color}"></span>'
-                    f'{hex_color} ({prop:.1%})</div>',
-                    unsafe_allow_html=True)
-
-            # Add save palette button
-            if st.button("Save This Palette"):
-                palette = save_palette(filtered_countries[selected_country],
-                                       colors, proportions)
-                st.success(
-                    "Palette saved! Check the sidebar to view saved palettes.")
-
-                # Show share buttons for the newly saved palette
-                share_links = create_share_links(palette)
-                st.markdown("### Share this palette")
-                display_share_buttons(share_links)
-
-        # Color mixing visualizations
-        st.subheader("Color Mixing Visualizations")
-
-        col3, col4 = st.columns(2)
-
-        with col3:
-            # Weighted mix visualization
-            weighted_mix = processor.get_weighted_mix()
-            weighted_hex = rgb_to_hex(weighted_mix)
-            st.markdown(
-                f"### Weighted Mix\n"
-                f'<div style="background-color: {weighted_hex}; padding: 20px; '
-                f'text-align: center; color: white; margin: 10px 0;">{weighted_hex}</div>',
-                unsafe_allow_html=True)
-            st.plotly_chart(create_color_visualization(colors, proportions,
-                                                       "Color Proportions"),
-                            use_container_width=True)
-
-        with col4:
-            # Equal mix visualization
-            equal_mix = processor.get_equal_mix()
-            equal_hex = rgb_to_hex(equal_mix)
-            st.markdown(
-                f"### Equal Mix\n"
-                f'<div style="background-color: {equal_hex}; padding: 20px; '
-                f'text-align: center; color: white; margin: 10px 0;">{equal_hex}</div>',
-                unsafe_allow_html=True)
-            equal_proportions = [1 / len(colors)] * len(colors)
-            st.plotly_chart(create_color_visualization(colors,
-                                                       equal_proportions,
-                                                       "Equal Distribution"),
-                            use_container_width=True)
+    render_debug_panel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+import json
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+def _metric_name(name):
+    """Turn a dotted span or counter name into a Prometheus-safe name."""
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+class Metrics:
+    """In-process registry of timing spans and counters.
+
+    Spans keep a running count, total and maximum per name, plus a bounded
+    log of recent events for JSONL export. Recording is a couple of dict
+    updates under a lock, cheap enough to leave on everywhere.
+    """
+
+    def __init__(self, max_events=10000):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._spans = {}
+        self._events = deque(maxlen=max_events)
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block under name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        """Record one completed span of the given duration."""
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = {
+                    'count': 0,
+                    'total_s': 0.0,
+                    'max_s': 0.0
+                }
+            stats['count'] += 1
+            stats['total_s'] += seconds
+            stats['max_s'] = max(stats['max_s'], seconds)
+            self._events.append({
+                'ts': time.time(),
+                'type': 'span',
+                'name': name,
+                'seconds': seconds
+            })
+
+    def incr(self, name, value=1):
+        """Add value to the counter name."""
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self):
+        """Return a copy of all span statistics and counters."""
+        with self._lock:
+            return {
+                'spans': {name: dict(stats)
+                          for name, stats in self._spans.items()},
+                'counters': dict(self._counters)
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+            self._events.clear()
+
+    def to_prometheus(self, prefix='flags'):
+        """Render the current metrics in the Prometheus text format."""
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot['spans']:
+            lines.append(f"# TYPE {prefix}_span_seconds summary")
+            for name, stats in sorted(snapshot['spans'].items()):
+                label = f'{{span="{name}"}}'
+                lines.append(f"{prefix}_span_seconds_count{label} "
+                             f"{stats['count']}")
+                lines.append(f"{prefix}_span_seconds_sum{label} "
+                             f"{stats['total_s']:.9f}")
+            lines.append(f"# TYPE {prefix}_span_seconds_max gauge")
+            for name, stats in sorted(snapshot['spans'].items()):
+                lines.append(f'{prefix}_span_seconds_max{{span="{name}"}} '
+                             f"{stats['max_s']:.9f}")
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def to_jsonl(self):
+        """Render recent span events plus a final counters line as JSONL."""
+        with self._lock:
+            events = list(self._events)
+            counters = dict(self._counters)
+        lines = [json.dumps(event) for event in events]
+        lines.append(
+            json.dumps({
+                'ts': time.time(),
+                'type': 'counters',
+                'counters': counters
+            }))
+        return '\n'.join(lines) + '\n'
+
+    def write_jsonl(self, path):
+        """Append recent events and the counters to a JSONL log file."""
+        with open(path, 'a') as log_file:
+            log_file.write(self.to_jsonl())
+
+
+# Process-wide registry shared by every module and Streamlit session
+metrics = Metrics()
+span = metrics.span
+incr = metrics.incr
@@ -1,77 +1,89 @@
 
 import streamlit as st
 import numpy as np
-import plotly.graph_objects as go
-from sklearn.cluster import KMeans
-import json
 from utils import rgb_to_hex
-import plotly.express as px
-
-def load_color_data():
-    with open('country_colors.json', 'r') as json_file:
-        return json.load(json_file)
-
-def hex_to_rgb(hex_color):
-    hex_color = hex_color.lstrip('#')
-    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+from color_processor import centers_to_rgb
+from color_clustering import (LARGE_DATA_THRESHOLD, MAX_PLOT_POINTS,
+                              cluster_members, fit_clusters,
+                              get_cluster_sweep, scatter_figure)
+from color_dataset import get_color_dataset
+from color_names import color_names
+from color_space import COLOR_SPACES, to_space
+from metrics import span
+from debug_panel import render_debug_panel
 
 def main():
     st.title("🎨 Flag Colors Clustering Analysis")
     
-    country_colors = load_color_data()
+    with span('page.load_data'):
+        dataset = get_color_dataset('country_colors.json')
     
-    # Extract all colors and their countries
-    all_colors = []
-    color_countries = []
-    for country, data in country_colors.items():
-        for color, prop in zip(data['colors'], data['proportions']):
-            all_colors.append(hex_to_rgb(color))
-            color_countries.append(country)
-    
-    # Convert to numpy array
-    X = np.array(all_colors)
+    # Every palette color, with the index of the country it came from
+    countries, X, color_owners = dataset.names, dataset.colors, dataset.owners
     
     # Clustering controls
     col1, col2 = st.columns(2)
     with col1:
         n_clusters = st.slider("Number of clusters", 2, 10, 5)
+    with col2:
+        space = st.selectbox("Color space", options=list(COLOR_SPACES),
+                             format_func=str.upper)
+    large_data = st.toggle(
+        "Large-data mode", value=len(X) > LARGE_DATA_THRESHOLD,
+        help="Cluster with mini-batch K-means and plot binned colors")
+    if large_data:
+        st.caption(f"{len(X):,} colors from {len(countries):,} countries")
     
-    # Perform K-means clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    cluster_labels = kmeans.fit_predict(X)
+    # Perform K-means clustering in the chosen working space
+    # Every k is precomputed once per dataset version; until that finishes
+    # in the background, fit the requested k directly
+    points = to_space(X, space)
+    sweep = get_cluster_sweep(dataset, 'colors', points, space, large_data)
+    if sweep is not None:
+        cluster_labels, cluster_centers = sweep.result(n_clusters)
+    else:
+        st.caption("Precomputing every number of clusters in the background")
+        with span('page.kmeans_fit'):
+            cluster_labels, cluster_centers = fit_clusters(
+                points, n_clusters, large=large_data)
     
     # Create 3D scatter plot
-    fig = px.scatter_3d(
-        x=X[:, 0], y=X[:, 1], z=X[:, 2],
-        color=[rgb_to_hex(c) for c in X],
-        hover_data={"Country": color_countries},
-        labels={"x": "Red", "y": "Green", "z": "Blue"},
-        title="Flag Colors in RGB Space"
-    )
+    with span('page.figure'):
+        fig = scatter_figure(
+            X, np.asarray(countries)[color_owners], "Flag Colors in RGB Space",
+            max_points=MAX_PLOT_POINTS if large_data else len(X))
     
     st.plotly_chart(fig, use_container_width=True)
     
+    if sweep is not None:
+        with st.expander("Cluster quality by number of clusters"):
+            st.plotly_chart(sweep.quality_figure(n_clusters),
+                            use_container_width=True)
+    
     # Display cluster centers
     st.subheader("Cluster Centers")
-    centers = kmeans.cluster_centers_.astype(int)
+    centers = centers_to_rgb(cluster_centers, space)
+    center_names = color_names(centers)
     
     cols = st.columns(n_clusters)
-    for idx, (col, center) in enumerate(zip(cols, centers)):
+    for idx, (col, center, name) in enumerate(zip(cols, centers,
+                                                  center_names)):
         hex_color = rgb_to_hex(center)
         col.markdown(
             f'<div style="background-color: {hex_color}; padding: 20px; '
             f'text-align: center; color: white; border-radius: 5px;">'
-            f'Cluster {idx+1}<br>{hex_color}</div>',
+            f'Cluster {idx+1}<br>{hex_color}<br>{name}</div>',
             unsafe_allow_html=True
         )
     
     # Show countries in each cluster
     st.subheader("Countries by Cluster")
-    for cluster_idx in range(n_clusters):
+    with span('page.group'):
+        members = cluster_members(cluster_labels, color_owners, n_clusters)
+    for cluster_idx, owners in enumerate(members):
         with st.expander(f"Cluster {cluster_idx + 1}"):
-            cluster_mask = cluster_labels == cluster_idx
-            cluster_countries = set([color_countries[i] for i in np.where(cluster_mask)[0]])
-            st.write(", ".join(sorted(cluster_countries)))
+            st.write(", ".join(sorted(countries[i] for i in owners)))
 
 if __name__ == "__main__":
     main()
+    render_debug_panel()
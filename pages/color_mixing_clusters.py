@@ -1,86 +1,110 @@
 
 import streamlit as st
 import numpy as np
-from sklearn.cluster import KMeans
-import json
-from utils import rgb_to_hex, mix_colors
-import plotly.express as px
-import plotly.graph_objects as go
+from utils import rgb_to_hex, rgb_to_hex_array, mix_palettes
+from color_processor import centers_to_rgb
+from color_clustering import (LARGE_DATA_THRESHOLD, MAX_PLOT_POINTS,
+                              cluster_members, fit_clusters,
+                              get_cluster_sweep, scatter_figure)
+from color_dataset import get_color_dataset
+from color_names import color_names
+from color_space import COLOR_SPACES, to_space
+from metrics import span
+from debug_panel import render_debug_panel
 
-def load_color_data():
-    with open('country_colors.json', 'r') as json_file:
-        return json.load(json_file)
-
-def hex_to_rgb(hex_color):
-    hex_color = hex_color.lstrip('#')
-    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+# Countries listed per color group; larger groups end with a count instead
+MAX_LISTED_COUNTRIES = 500
 
 def main():
     st.title("🎨 Flag Colors Mixing Analysis")
     
-    country_colors = load_color_data()
-    
-    # Calculate mixed colors for each country
-    mixed_colors = {}
-    for country, data in country_colors.items():
-        colors = [hex_to_rgb(color) for color in data['colors']]
-        proportions = data['proportions']
-        mixed_colors[country] = mix_colors(colors, proportions)
-    
-    # Convert mixed colors to array for clustering
-    countries = list(mixed_colors.keys())
-    X = np.array([mixed_colors[country] for country in countries])
+    with span('page.load_data'):
+        dataset = get_color_dataset('country_colors.json')
     
     # Clustering controls
     col1, col2 = st.columns(2)
     with col1:
         n_clusters = st.slider("Number of clusters", 2, 10, 5)
+    with col2:
+        space = st.selectbox("Color space", options=list(COLOR_SPACES),
+                             format_func=str.upper)
     
-    # Perform K-means clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    cluster_labels = kmeans.fit_predict(X)
+    # Calculate mixed colors for every country in one vectorized pass
+    countries = dataset.names
+    X, _ = mix_palettes(dataset.colors, dataset.offsets, dataset.proportions,
+                        space=space)
+    
+    large_data = st.toggle(
+        "Large-data mode", value=len(X) > LARGE_DATA_THRESHOLD,
+        help="Cluster with mini-batch K-means and plot binned colors")
+    if large_data:
+        st.caption(f"{len(X):,} mixed colors")
+    
+    # Perform K-means clustering in the chosen working space
+    # Every k is precomputed once per dataset version; until that finishes
+    # in the background, fit the requested k directly
+    points = to_space(X, space)
+    sweep = get_cluster_sweep(dataset, 'mixes', points, space, large_data)
+    if sweep is not None:
+        cluster_labels, cluster_centers = sweep.result(n_clusters)
+    else:
+        st.caption("Precomputing every number of clusters in the background")
+        with span('page.kmeans_fit'):
+            cluster_labels, cluster_centers = fit_clusters(
+                points, n_clusters, large=large_data)
     
     # Create 3D scatter plot of mixed colors
-    fig = px.scatter_3d(
-        x=X[:, 0], y=X[:, 1], z=X[:, 2],
-        color=[rgb_to_hex(c) for c in X],
-        hover_data={"Country": countries},
-        labels={"x": "Red", "y": "Green", "z": "Blue"},
-        title="Mixed Flag Colors in RGB Space"
-    )
+    with span('page.figure'):
+        fig = scatter_figure(
+            X, countries, "Mixed Flag Colors in RGB Space",
+            max_points=MAX_PLOT_POINTS if large_data else len(X))
     
     st.plotly_chart(fig, use_container_width=True)
     
+    if sweep is not None:
+        with st.expander("Cluster quality by number of clusters"):
+            st.plotly_chart(sweep.quality_figure(n_clusters),
+                            use_container_width=True)
+    
     # Display cluster centers with their mixed colors
     st.subheader("Cluster Centers")
-    centers = kmeans.cluster_centers_.astype(int)
+    centers = centers_to_rgb(cluster_centers, space)
+    center_names = color_names(centers)
     
     cols = st.columns(n_clusters)
-    for idx, (col, center) in enumerate(zip(cols, centers)):
+    for idx, (col, center, name) in enumerate(zip(cols, centers,
+                                                  center_names)):
         hex_color = rgb_to_hex(center)
         col.markdown(
             f'<div style="background-color: {hex_color}; padding: 20px; '
             f'text-align: center; color: white; border-radius: 5px;">'
-            f'Cluster {idx+1}<br>{hex_color}</div>',
+            f'Cluster {idx+1}<br>{hex_color}<br>{name}</div>',
             unsafe_allow_html=True
         )
     
     # Show similar color palettes
     st.subheader("Countries with Similar Mixed Colors")
-    for cluster_idx in range(n_clusters):
+    with span('page.group'):
+        members = cluster_members(cluster_labels, np.arange(len(countries)),
+                                  n_clusters)
+        mixed_hex = rgb_to_hex_array(X)
+        mixed_names = color_names(X)
+    for cluster_idx, owners in enumerate(members):
         with st.expander(f"Color Group {cluster_idx + 1}"):
-            cluster_countries = [countries[i] for i in np.where(cluster_labels == cluster_idx)[0]]
-            
-            # Display mixed colors for each country in cluster
-            for country in sorted(cluster_countries):
-                hex_color = rgb_to_hex(mixed_colors[country])
-                st.markdown(
-                    f'<div style="display: flex; align-items: center; margin: 5px 0;">'
-                    f'<span style="background-color: {hex_color}; width: 20px; height: 20px; '
-                    f'display: inline-block; margin-right: 10px;"></span>'
-                    f'{country} - {hex_color}</div>',
-                    unsafe_allow_html=True
-                )
+            # Display mixed colors for each country in cluster, as one block
+            owners = sorted(owners, key=countries.__getitem__)
+            rows = [
+                f'<div style="display: flex; align-items: center; margin: 5px 0;">'
+                f'<span style="background-color: {mixed_hex[i]}; width: 20px; height: 20px; '
+                f'display: inline-block; margin-right: 10px;"></span>'
+                f'{countries[i]} - {mixed_hex[i]} ({mixed_names[i]})</div>'
+                for i in owners[:MAX_LISTED_COUNTRIES]
+            ]
+            st.markdown("".join(rows), unsafe_allow_html=True)
+            if len(owners) > MAX_LISTED_COUNTRIES:
+                st.caption(
+                    f"and {len(owners) - MAX_LISTED_COUNTRIES:,} more")
 
 if __name__ == "__main__":
     main()
+    render_debug_panel()
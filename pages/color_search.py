@@ -0,0 +1,49 @@
+import streamlit as st
+from color_index import get_color_index
+from debug_panel import render_debug_panel
+
+def main():
+    st.title("🎨 Find Flags by Color")
+    
+    index = get_color_index('country_colors.json')
+    
+    # Query controls
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        picked_color = st.color_picker("Pick a color", "#b22234")
+    with col2:
+        typed_color = st.text_input("...or type a hex code", "")
+    with col3:
+        k = st.slider("Number of flags", 1, 20, 5)
+    mode = st.radio("Match on",
+                    options=['palette', 'mix'],
+                    format_func=lambda x: {
+                        'palette': "Any palette color",
+                        'mix': "Weighted mix"
+                    }[x],
+                    horizontal=True)
+    
+    query_color = typed_color.strip() or picked_color
+    try:
+        matches = index.query(query_color, k=k, mode=mode)
+    except ValueError:
+        st.error(f"'{query_color}' is not a valid hex color")
+        return
+    
+    st.subheader(f"Flags closest to {query_color}")
+    for match in matches:
+        details = f"{match['color']} (distance {match['distance']:.1f}"
+        if 'proportion' in match:
+            details += f", {match['proportion']:.1%} of the flag"
+        details += ")"
+        st.markdown(
+            f'<div style="display: flex; align-items: center; margin: 5px 0;">'
+            f'<span style="background-color: {match["color"]}; width: 20px; height: 20px; '
+            f'display: inline-block; margin-right: 10px;"></span>'
+            f'{match["country"]} - {details}</div>',
+            unsafe_allow_html=True
+        )
+
+if __name__ == "__main__":
+    main()
+    render_debug_panel()
@@ -0,0 +1,52 @@
+import streamlit as st
+from color_dataset import get_color_dataset
+from palette_distance import get_palette_distances
+from debug_panel import render_debug_panel
+
+def palette_html(colors):
+    return "".join([
+        f'<span style="background-color: {color}; width: 20px; height: 20px; '
+        f'display: inline-block; margin-right: 2px;"></span>'
+        for color in colors
+    ])
+
+def main():
+    st.title("🎨 Flag Palette Similarity")
+    
+    dataset = get_color_dataset('country_colors.json')
+    distances = get_palette_distances('country_colors.json')
+    
+    # Most similar flags to a chosen country
+    col1, col2 = st.columns(2)
+    with col1:
+        country = st.selectbox("Country", options=distances.names)
+    with col2:
+        k = st.slider("Number of similar flags", 1, 20, 5)
+    
+    st.markdown(f"{palette_html(dataset.palette_hex(country))} **{country}**",
+                unsafe_allow_html=True)
+    st.subheader("Most Similar Palettes")
+    for other, distance in distances.most_similar(country, k):
+        st.markdown(
+            f'<div style="display: flex; align-items: center; margin: 5px 0;">'
+            f'{palette_html(dataset.palette_hex(other))}'
+            f'<span style="margin-left: 10px;">{other} - distance {distance:.1f}</span></div>',
+            unsafe_allow_html=True
+        )
+    
+    # Hierarchical clustering on the full distance matrix
+    st.subheader("Palette Families")
+    n_groups = st.slider("Number of groups", 2, 20, 8)
+    for idx, group in enumerate(distances.clusters(n_groups)):
+        with st.expander(f"Family {idx + 1} ({len(group)} flags)"):
+            for member in sorted(group):
+                st.markdown(
+                    f'<div style="display: flex; align-items: center; margin: 5px 0;">'
+                    f'{palette_html(dataset.palette_hex(member))}'
+                    f'<span style="margin-left: 10px;">{member}</span></div>',
+                    unsafe_allow_html=True
+                )
+
+if __name__ == "__main__":
+    main()
+    render_debug_panel()
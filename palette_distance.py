@@ -0,0 +1,226 @@
+import hashlib
+import os
+import threading
+from io import BytesIO
+
+import numpy as np
+
+from color_dataset import get_color_dataset
+from flag_cache import atomic_write
+
+# Largest possible distance between two RGB colors, used to scale costs
+MAX_RGB_DISTANCE = 255 * np.sqrt(3)
+
+
+def pad_palettes(colors, proportions, offsets):
+    """Pad ragged palettes into (P, K, 3) colors and (P, K) weights.
+
+    Padding slots get zero weight so they never carry any mass.
+    """
+    lengths = np.diff(offsets)
+    n_palettes, width = len(lengths), max(int(lengths.max(initial=1)), 1)
+    padded_colors = np.zeros((n_palettes, width, 3))
+    padded_weights = np.zeros((n_palettes, width))
+    owners = np.repeat(np.arange(n_palettes), lengths)
+    slots = np.arange(len(colors)) - offsets[owners]
+    padded_colors[owners, slots] = colors
+    padded_weights[owners, slots] = proportions
+    totals = padded_weights.sum(axis=1, keepdims=True)
+    padded_weights /= np.where(totals > 0, totals, 1)
+    return padded_colors, padded_weights
+
+
+def emd_block(row_colors,
+              row_weights,
+              col_colors,
+              col_weights,
+              epsilon=0.01,
+              max_iter=500,
+              tol=1e-7):
+    """Earth Mover's distance between every row palette and column palette.
+
+    Solved for all pairs at once with entropy-regularized optimal transport
+    (Sinkhorn iterations) followed by rounding onto the exact marginals;
+    ``epsilon`` is relative to the largest RGB distance, so small values
+    closely approximate the exact EMD. Returns a (rows, cols) matrix in RGB
+    distance units.
+    """
+    # cost[r, c, i, j]: distance from color i of row r to color j of column c
+    diffs = (row_colors[:, np.newaxis, :, np.newaxis, :] -
+             col_colors[np.newaxis, :, np.newaxis, :, :])
+    cost = np.sqrt(np.sum(diffs * diffs, axis=-1)) / MAX_RGB_DISTANCE
+    # Costs are at most 1, so the kernel stays above exp(-1 / epsilon) and
+    # the scaling-domain iterations cannot underflow for epsilon >= 0.002
+    kernel = np.exp(-cost / epsilon)
+    source = np.broadcast_to(row_weights[:, np.newaxis, :], cost.shape[:3])
+    target = np.broadcast_to(col_weights[np.newaxis, :, :],
+                             source.shape[:2] + col_weights.shape[1:])
+    v = np.ones(target.shape)
+    for iteration in range(max_iter):
+        u = source / np.einsum('rcij,rcj->rci', kernel, v)
+        v = target / np.einsum('rcij,rci->rcj', kernel, u)
+        if iteration % 10 == 0:
+            row_mass = u * np.einsum('rcij,rcj->rci', kernel, v)
+            if np.max(np.abs(row_mass - source)) < tol:
+                break
+    plan = u[..., :, np.newaxis] * kernel * v[..., np.newaxis, :]
+    # Sinkhorn converges slowly on the last bit of mass between distant
+    # colors; round the plan onto the exact marginals (Altschuler et al.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        row_scale = np.minimum(1, source / plan.sum(axis=3))
+        plan *= np.nan_to_num(row_scale)[..., :, np.newaxis]
+        col_scale = np.minimum(1, target / plan.sum(axis=2))
+        plan *= np.nan_to_num(col_scale)[..., np.newaxis, :]
+    row_error = np.maximum(source - plan.sum(axis=3), 0)
+    col_error = np.maximum(target - plan.sum(axis=2), 0)
+    missing = row_error.sum(axis=2)
+    missing = np.where(missing > 0, missing, 1)
+    plan += (row_error[..., :, np.newaxis] * col_error[..., np.newaxis, :] /
+             missing[..., np.newaxis, np.newaxis])
+    return np.sum(plan * cost, axis=(2, 3)) * MAX_RGB_DISTANCE
+
+
+def palette_keys(dataset):
+    """Hash each palette so changed countries can be detected cheaply."""
+    keys = []
+    for start, end in zip(dataset.offsets[:-1], dataset.offsets[1:]):
+        digest = hashlib.blake2b(digest_size=12)
+        digest.update(np.ascontiguousarray(dataset.colors[start:end]))
+        digest.update(np.ascontiguousarray(dataset.proportions[start:end]))
+        keys.append(digest.hexdigest())
+    return np.array(keys)
+
+
+class PaletteDistances:
+    """Pairwise palette distance matrix for a country colors dataset."""
+
+    def __init__(self, names, matrix, keys, version=None):
+        self.names = list(names)
+        self.matrix = matrix
+        self.keys = np.asarray(keys)
+        self.version = version
+        self._positions = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def compute(cls,
+                dataset,
+                previous=None,
+                version=None,
+                block_size=None):
+        """Compute the matrix, reusing rows of ``previous`` that still match.
+
+        Only countries that are new or whose palette changed since
+        ``previous`` are recomputed against the rest of the dataset.
+        """
+        names = dataset.names
+        keys = palette_keys(dataset)
+        padded_colors, padded_weights = pad_palettes(dataset.colors,
+                                                     dataset.proportions,
+                                                     dataset.offsets)
+        n = len(names)
+        matrix = np.zeros((n, n), dtype=np.float32)
+        stale = np.ones(n, dtype=bool)
+
+        if previous is not None:
+            old_index = np.array(
+                [previous._positions.get(name, -1) for name in names])
+            known = old_index >= 0
+            known[known] = previous.keys[old_index[known]] == keys[known]
+            reused = np.flatnonzero(known)
+            matrix[np.ix_(reused, reused)] = previous.matrix[np.ix_(
+                old_index[reused], old_index[reused])]
+            stale = ~known
+
+        rows = np.flatnonzero(stale)
+        if block_size is None:
+            # Keep each block's (rows, n, K, K) tensors around 32 MB
+            per_row = n * padded_colors.shape[1]**2 * 8 * 4
+            block_size = max(1, int(32e6 // max(per_row, 1)))
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            distances = emd_block(padded_colors[block],
+                                  padded_weights[block], padded_colors,
+                                  padded_weights)
+            matrix[block, :] = distances
+            matrix[:, block] = distances.T
+        np.fill_diagonal(matrix, 0)
+        return cls(names, matrix, keys, version)
+
+    def save(self, path):
+        buffer = BytesIO()
+        np.savez(buffer,
+                 names=np.array(self.names),
+                 matrix=self.matrix,
+                 keys=self.keys,
+                 version=np.array(self.version or ''))
+        atomic_write(path, buffer.getvalue())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['names'].tolist(), data['matrix'], data['keys'],
+                       str(data['version']) or None)
+
+    def most_similar(self, country, k=5):
+        """Return the k countries whose palettes are closest to country's."""
+        row = self.matrix[self._positions[country]]
+        order = np.argsort(row, kind='stable')
+        order = order[order != self._positions[country]][:k]
+        return [(self.names[i], float(row[i])) for i in order]
+
+    def linkage(self, method='average'):
+        """Hierarchical clustering linkage computed from the matrix."""
+        from scipy.cluster.hierarchy import linkage
+        from scipy.spatial.distance import squareform
+
+        condensed = squareform(self.matrix.astype(np.float64), checks=False)
+        return linkage(condensed, method=method)
+
+    def clusters(self, n_clusters, method='average'):
+        """Cut the hierarchy into n_clusters groups; returns country lists."""
+        from scipy.cluster.hierarchy import fcluster
+
+        labels = fcluster(self.linkage(method),
+                          n_clusters,
+                          criterion='maxclust')
+        groups = {}
+        for name, label in zip(self.names, labels):
+            groups.setdefault(label, []).append(name)
+        return [groups[label] for label in sorted(groups)]
+
+
+_distances = {}
+_distances_lock = threading.Lock()
+
+
+def get_palette_distances(filename='country_colors.json', cache_path=None):
+    """Return the distance matrix for a dataset file.
+
+    The matrix is stored next to the dataset (or at ``cache_path``) together
+    with the dataset hash. When the file changes, only countries whose
+    palettes differ from the stored matrix are recomputed.
+    """
+    if cache_path is None:
+        cache_path = os.path.splitext(filename)[0] + '.distances.npz'
+    dataset = get_color_dataset(filename)
+    version = dataset.version
+    with _distances_lock:
+        cached = _distances.get(filename)
+        if cached is not None and cached.version == version:
+            return cached
+
+        previous = None
+        if os.path.exists(cache_path):
+            try:
+                previous = PaletteDistances.load(cache_path)
+            except (OSError, ValueError, KeyError):
+                previous = None
+        if previous is not None and previous.version == version:
+            distances = previous
+        else:
+            distances = PaletteDistances.compute(dataset,
+                                                 previous=previous,
+                                                 version=version)
+            distances.save(cache_path)
+        _distances[filename] = distances
+        return distances
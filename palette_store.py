@@ -0,0 +1,219 @@
+import json
+import os
+import sqlite3
+import textwrap
+import threading
+from datetime import datetime, timedelta
+
+# Saved palettes are user data, so they live apart from the flag cache,
+# which may be cleared at any time
+DEFAULT_DATA_DIR = os.path.join(os.path.expanduser('~'), '.local', 'share',
+                                'flag-color-analyzer')
+
+# Retention: the most palettes kept per owner (the oldest are dropped beyond
+# it), and the days an owner may go without saving before their palettes
+# are deleted
+MAX_PALETTES_PER_OWNER = 1000
+OWNER_RETENTION_DAYS = 365
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS palettes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    country TEXT NOT NULL,
+    colors TEXT NOT NULL,
+    proportions TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS palettes_owner_timestamp
+    ON palettes (owner, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS palettes_owner_country
+    ON palettes (owner, country);
+"""
+
+_COLUMNS = "id, country, colors, proportions, timestamp"
+
+
+def _row_to_palette(row):
+    palette_id, country, colors, proportions, timestamp = row
+    return {
+        'id': palette_id,
+        'country': country,
+        'colors': json.loads(colors),
+        'proportions': json.loads(proportions),
+        'timestamp': timestamp
+    }
+
+
+class PaletteStore:
+    """Saved palettes in SQLite, scoped per owner and listed newest first.
+
+    Listing is paginated through the (owner, timestamp) index, so a page
+    costs the same no matter how many palettes an owner has saved.
+
+    Growth is bounded: an owner keeps at most ``max_per_owner`` palettes,
+    and owners who saved nothing for ``retention_days`` are deleted when
+    the store is opened. Pass None to disable either limit.
+    """
+
+    def __init__(self,
+                 path=None,
+                 max_per_owner=MAX_PALETTES_PER_OWNER,
+                 retention_days=OWNER_RETENTION_DAYS):
+        if path is None:
+            path = os.environ.get('FLAG_PALETTE_DB') or os.path.join(
+                os.environ.get('FLAG_DATA_DIR') or DEFAULT_DATA_DIR,
+                'palettes.sqlite3')
+        self.path = path
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path) or os.curdir,
+                        exist_ok=True)
+        self._connection = sqlite3.connect(self.path,
+                                           check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            if self.path != ':memory:':
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        self.max_per_owner = max_per_owner
+        self.retention_days = retention_days
+        if retention_days is not None:
+            self.prune_inactive(retention_days)
+
+    def add(self, owner, country, colors, proportions, timestamp=None):
+        """Save a palette of hex colors and return it with its new id."""
+        if timestamp is None:
+            timestamp = datetime.now().strftime(_TIMESTAMP_FORMAT)
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO palettes (owner, country, colors, proportions, "
+                "timestamp) VALUES (?, ?, ?, ?, ?)",
+                (owner, country, json.dumps(list(colors)),
+                 json.dumps(list(proportions)), timestamp))
+            if self.max_per_owner is not None:
+                # Drop whatever falls past the cap, oldest first
+                self._connection.execute(
+                    "DELETE FROM palettes WHERE owner = ? AND id IN ("
+                    "SELECT id FROM palettes WHERE owner = ? "
+                    "ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET ?)",
+                    (owner, owner, self.max_per_owner))
+        return {
+            'id': cursor.lastrowid,
+            'country': country,
+            'colors': list(colors),
+            'proportions': list(proportions),
+            'timestamp': timestamp
+        }
+
+    def remove(self, owner, palette_id):
+        """Delete one palette; returns False if the owner has no such id."""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM palettes WHERE owner = ? AND id = ?",
+                (owner, palette_id))
+        return cursor.rowcount > 0
+
+    def prune_inactive(self, days):
+        """Delete every palette of owners who saved nothing in ``days`` days.
+
+        Returns the number of palettes deleted.
+        """
+        cutoff = (datetime.now() - timedelta(days=days)).strftime(
+            _TIMESTAMP_FORMAT)
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "DELETE FROM palettes WHERE owner IN ("
+                "SELECT owner FROM palettes GROUP BY owner "
+                "HAVING MAX(timestamp) < ?)", (cutoff, ))
+        return cursor.rowcount
+
+    def count(self, owner, country=None):
+        query = "SELECT COUNT(*) FROM palettes WHERE owner = ?"
+        params = (owner, )
+        if country is not None:
+            query += " AND country = ?"
+            params += (country, )
+        with self._lock:
+            return self._connection.execute(query, params).fetchone()[0]
+
+    def page(self, owner, offset=0, limit=10, country=None):
+        """Return up to limit palettes starting at offset, newest first."""
+        query = f"SELECT {_COLUMNS} FROM palettes WHERE owner = ?"
+        params = (owner, )
+        if country is not None:
+            query += " AND country = ?"
+            params += (country, )
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._connection.execute(query,
+                                            params + (limit, offset)).fetchall()
+        return [_row_to_palette(row) for row in rows]
+
+    def iter_palettes(self, owner, batch_size=500):
+        """Yield every palette of an owner, newest first, in small batches.
+
+        Each batch resumes after the last row of the previous one (keyset
+        pagination), so the lock is never held for the whole scan.
+        """
+        last = None
+        while True:
+            query = f"SELECT {_COLUMNS} FROM palettes WHERE owner = ?"
+            params = (owner, )
+            if last is not None:
+                query += " AND (timestamp, id) < (?, ?)"
+                params += (last['timestamp'], last['id'])
+            query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+            with self._lock:
+                rows = self._connection.execute(
+                    query, params + (batch_size, )).fetchall()
+            for row in rows:
+                last = _row_to_palette(row)
+                yield last
+            if len(rows) < batch_size:
+                return
+
+    def export_json(self, owner):
+        """Yield the owner's palettes as chunks of one JSON document.
+
+        The document is built row by row instead of as one list in memory,
+        in the same layout as ``json.dumps(..., indent=2)`` of the whole
+        export. Each palette also lists the nearest CSS name of every color.
+        """
+        from color_names import get_color_namer
+
+        namer = get_color_namer()
+        yield '{\n  "palettes": ['
+        first = True
+        for palette in self.iter_palettes(owner):
+            del palette['id']  # Internal row id, not part of the export
+            palette['names'] = namer.name_hex(palette['colors'])
+            yield ('\n' if first else ',\n') + textwrap.indent(
+                json.dumps(palette, indent=2), '    ')
+            first = False
+        yield ']' if first else '\n  ]'
+        exported_at = datetime.now().strftime(_TIMESTAMP_FORMAT)
+        yield f',\n  "exported_at": {json.dumps(exported_at)}\n}}'
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_palette_store():
+    """Return the process-wide palette store.
+
+    The database lives in ``FLAG_DATA_DIR`` (by default
+    ``~/.local/share/flag-color-analyzer``) unless ``FLAG_PALETTE_DB`` names
+    another file.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = PaletteStore()
+        return _default_store
@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+
+def flag_png(color, size=(30, 20)):
+    """PNG bytes of a plain flag in one color."""
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FlagServer:
+    """Local stand-in for flagcdn, serving ``/w<width>/<code>.png``.
+
+    ``flags`` maps lowercase codes to response bodies, served with an ETag
+    so conditional requests get a 304. Statuses queued in ``script[code]``
+    are answered, one per request, before the flag itself. Every request
+    waits ``delay`` seconds and is logged in ``requests`` as (code, status);
+    ``max_in_flight`` records the most requests handled at once.
+    """
+
+    def __init__(self):
+        self.flags = {}
+        self.script = {}
+        self.delay = 0
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                           self._handler_class())
+        self.url_template = (f"http://127.0.0.1:{self._server.server_port}"
+                             "/w{width}/{code}.png")
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        return Handler
+
+    def respond(self, handler, code):
+        with self._lock:
+            queued = self.script.get(code)
+            status = queued.pop(0) if queued else None
+        body = self.flags.get(code)
+        if status is None:
+            status = 404 if body is None else 200
+        etag = None
+        if status == 200:
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+            if handler.headers.get('If-None-Match') == etag:
+                status = 304
+        with self._lock:
+            self.requests.append((code, status))
+        handler.send_response(status)
+        if etag:
+            handler.send_header('ETag', etag)
+        if status == 200:
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        else:
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+
+    def handle(self, handler):
+        code = handler.path.rsplit('/', 1)[-1].split('.')[0]
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            self.respond(handler, code)
+        except OSError:
+            # The client gave up waiting and closed the connection
+            pass
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def statuses(self, code):
+        return [status for logged, status in self.requests if logged == code]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def flag_server():
+    server = FlagServer()
+    yield server
+    server.close()
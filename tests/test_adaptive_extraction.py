@@ -0,0 +1,30 @@
+from adaptive_extraction import ADAPTIVE_WIDTHS, extract_colors_adaptive
+from benchmark import synthesize_flag
+
+
+def test_image_narrower_than_every_level_is_used_as_is():
+    width = ADAPTIVE_WIDTHS[0] - 20
+    image, true_colors, _ = synthesize_flag('stripes', width)
+    colors, _, settled = extract_colors_adaptive(image=image)
+    assert settled == width
+    assert len(colors) == len(true_colors)
+
+
+def test_settles_on_a_reduced_level():
+    image, true_colors, _ = synthesize_flag('cross', 640)
+    colors, _, settled = extract_colors_adaptive(image=image)
+    assert settled in ADAPTIVE_WIDTHS
+    assert len(colors) == len(true_colors)
+
+
+def test_reports_actual_width_of_reduced_levels():
+    image, true_colors, _ = synthesize_flag('cross', 500)
+    colors, _, settled = extract_colors_adaptive(image=image)
+    # 500 px reduces by whole factors to 84, 167 and 500 px
+    level_widths = {
+        image.reduce(500 // width).width
+        for width in ADAPTIVE_WIDTHS[:3]
+    }
+    assert level_widths == {84, 167, 500}
+    assert settled in level_widths
+    assert len(colors) == len(true_colors)
@@ -0,0 +1,118 @@
+import hashlib
+import json
+from io import BytesIO
+
+import batch
+from adaptive_extraction import ADAPTIVE_WIDTHS
+from batch import (_extract_palette_file, manifest_path, read_checkpoint,
+                   read_manifest)
+from benchmark import synthesize_flag
+from color_processor import EXTRACTION_VERSION
+from flag_cache import FlagCache
+from http_client import HttpClient
+from metrics import metrics
+
+PARAMS = {'n_colors': 5, 'width': 640, 'adaptive': False}
+
+
+def _record(code, **extra):
+    return {
+        'code': code,
+        'name': code,
+        'sha256': 'a' * 64,
+        'params': PARAMS,
+        'extraction_version': EXTRACTION_VERSION,
+        'colors': ['#ffffff'],
+        'proportions': [1.0],
+        **extra
+    }
+
+
+def test_read_checkpoint_discards_mismatching_records(tmp_path):
+    checkpoint = tmp_path / 'colors.json.partial.jsonl'
+    lines = [
+        json.dumps(_record('FR')),
+        json.dumps(_record('DE', params={**PARAMS, 'n_colors': 3})),
+        json.dumps(_record('JP', extraction_version=EXTRACTION_VERSION - 1)),
+        json.dumps(_record('US', sha256='b' * 64)),
+        '{"code": "IT", "col',
+    ]
+    checkpoint.write_text('\n'.join(lines) + '\n')
+    fingerprints = {code: {'sha256': 'a' * 64} for code in ('FR', 'JP', 'US')}
+    assert set(read_checkpoint(str(checkpoint))) == {'FR', 'DE', 'JP', 'US'}
+    records = read_checkpoint(str(checkpoint), PARAMS, fingerprints)
+    assert set(records) == {'FR'}
+
+
+def test_read_manifest_ignores_manifest_of_other_dataset(tmp_path):
+    dataset = tmp_path / 'colors.json'
+    dataset.write_bytes(b'{}')
+    countries = {'FR': {'name': 'France'}}
+    manifest = {
+        'dataset_sha256': hashlib.sha256(b'{}').hexdigest(),
+        'countries': countries
+    }
+    with open(manifest_path(str(dataset)), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    assert read_manifest(str(dataset)) == countries
+    dataset.write_bytes(b'{"France": {}}')
+    assert read_manifest(str(dataset)) == {}
+
+
+def test_adaptive_applies_to_image_files(tmp_path):
+    image, true_colors, _ = synthesize_flag('cross', 640)
+    path = str(tmp_path / 'cross.png')
+    image.save(path)
+    record = _extract_palette_file(path, 'auto', adaptive=True)
+    assert record['width'] in ADAPTIVE_WIDTHS
+    assert len(record['colors']) == len(true_colors)
+    assert 'width' not in _extract_palette_file(path, 'auto')
+
+
+def _flag_bytes(name):
+    buffer = BytesIO()
+    synthesize_flag(name, 160)[0].save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_rebuild_extracts_only_changed_flags(tmp_path, flag_server,
+                                             monkeypatch):
+    cache = FlagCache(cache_dir=str(tmp_path / 'flags'),
+                      offline=False,
+                      url_template=flag_server.url_template,
+                      client=HttpClient(max_attempts=1))
+    monkeypatch.setattr(batch, 'get_default_cache', lambda: cache)
+    flag_server.flags.update(fr=_flag_bytes('stripes'),
+                             jp=_flag_bytes('emblem'))
+    countries = {'FR': 'France', 'JP': 'Japan'}
+    filename = str(tmp_path / 'colors.json')
+
+    def rebuild():
+        metrics.reset()
+        country_colors, failures = batch.rebuild_country_colors(
+            filename, countries=countries, width=160, extract_workers=1)
+        assert failures == {}
+        return metrics.snapshot()['counters']
+
+    counters = rebuild()
+    assert counters['rebuild.extracted'] == 2
+    # One request per country: extraction reuses the revalidation download
+    assert sorted(flag_server.requests) == [('fr', 200), ('jp', 200)]
+
+    flag_server.flags['jp'] = _flag_bytes('cross')
+    counters = rebuild()
+    assert counters['rebuild.unchanged'] == 1
+    assert counters['rebuild.extracted'] == 1
+    assert flag_server.statuses('fr') == [200, 304]
+    assert flag_server.statuses('jp') == [200, 200]
+
+    fingerprints = {
+        code: cache.metadata(code, 160)
+        for code in countries
+    }
+    params = {'n_colors': 5, 'width': 160, 'adaptive': False}
+    records = batch.unchanged_records(countries, fingerprints, params,
+                                      filename)
+    assert set(records) == {'FR', 'JP'}
+    assert batch.unchanged_records(countries, fingerprints,
+                                   {**params, 'n_colors': 3}, filename) == {}
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from color_clustering import cluster_members, voxel_bins
+
+
+def test_voxel_bins_keeps_exact_colors_within_budget():
+    rgb = np.array([[255, 0, 0], [0, 0, 255], [255, 0, 0], [1, 2, 3]],
+                   dtype=np.uint8)
+    means, counts, inverse, first = voxel_bins(rgb, max_points=10)
+    assert len(means) == 3
+    np.testing.assert_array_equal(means[inverse], rgb)
+    assert sorted(counts) == [1, 1, 2]
+    np.testing.assert_array_equal(inverse[first], np.arange(len(means)))
+
+
+@pytest.mark.parametrize('max_points', [8, 100, 1000])
+def test_voxel_bins_respects_budget(max_points):
+    rgb = np.random.default_rng(0).integers(0, 256, (20000, 3),
+                                            dtype=np.uint8)
+    means, counts, inverse, first = voxel_bins(rgb, max_points)
+    assert 1 < len(means) <= max_points
+    assert counts.sum() == len(rgb)
+    np.testing.assert_array_equal(np.bincount(inverse), counts)
+    np.testing.assert_array_equal(inverse[first], np.arange(len(means)))
+    for cube in range(0, len(means), max(1, len(means) // 10)):
+        members = rgb[inverse == cube].astype(float)
+        np.testing.assert_allclose(means[cube], members.mean(axis=0),
+                                   atol=0.5)
+
+
+def test_cluster_members_matches_per_cluster_sets():
+    rng = np.random.default_rng(1)
+    n_clusters = 12
+    # Cluster 11 is left empty
+    labels = rng.integers(0, n_clusters - 1, 5000)
+    owners = rng.integers(0, 40, 5000)
+    members = cluster_members(labels, owners, n_clusters)
+    assert len(members) == n_clusters
+    for cluster in range(n_clusters):
+        expected = sorted(set(owners[np.where(labels == cluster)[0]]))
+        assert members[cluster].tolist() == expected
+    assert members[-1].tolist() == []
+
+
+def test_cluster_members_without_points():
+    members = cluster_members(np.array([], dtype=int),
+                              np.array([], dtype=int), 3)
+    assert [m.tolist() for m in members] == [[], [], []]
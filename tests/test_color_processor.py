@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from benchmark import SYNTHETIC_FLAGS, synthesize_flag
+from color_processor import ColorProcessor
+
+
+def _assert_palette(colors, true_colors):
+    assert len(colors) == len(true_colors)
+    distances = np.linalg.norm(colors[:, np.newaxis].astype(float) -
+                               np.asarray(true_colors, dtype=float),
+                               axis=2)
+    # Every extracted color is one of the flag's colors, and none is missed
+    assert distances.min(axis=1).max() < 8
+    assert distances.min(axis=0).max() < 8
+
+
+@pytest.mark.parametrize('n_colors', [5, 'auto'])
+@pytest.mark.parametrize('algorithm', ['histogram', 'kmeans'])
+@pytest.mark.parametrize('width', [320, 640])
+@pytest.mark.parametrize('flag', sorted(SYNTHETIC_FLAGS))
+def test_extracts_flag_colors_without_blends(flag, width, algorithm,
+                                             n_colors):
+    image, true_colors, _ = synthesize_flag(flag, width)
+    colors, _ = ColorProcessor(image).extract_colors(n_colors=n_colors,
+                                                     algorithm=algorithm)
+    _assert_palette(colors, true_colors)
+
+
+def _accents_flag(square_side):
+    """White over blue, a 4% red disc and three small accent squares."""
+
+    def draw_flag(draw, width, height):
+        white, blue, red = (255, 255, 255), (0, 56, 147), (206, 17, 38)
+        accents = [(252, 209, 22), (0, 122, 61), (0, 0, 0)]
+        draw.rectangle([0, 0, width, height], fill=white)
+        draw.rectangle([0, height / 2, width, height], fill=blue)
+        radius = (0.04 * width * height / np.pi)**0.5
+        x, y = width / 2, height / 4
+        draw.ellipse([x - radius, y - radius, x + radius, y + radius],
+                     fill=red)
+        side = height * square_side
+        for i, color in enumerate(accents):
+            x = width * (0.15 + 0.3 * i)
+            draw.rectangle([x, height * 0.7, x + side, height * 0.7 + side],
+                           fill=color)
+        return [white, blue, red] + accents
+
+    return draw_flag, 2 / 3, 0
+
+
+@pytest.mark.parametrize('width', [320, 640])
+@pytest.mark.parametrize('square_side, n_expected', [(0.1, 3), (0.15, 6)])
+def test_auto_size_keeps_colors_pure(monkeypatch, square_side, n_expected,
+                                     width):
+    # Accents under 1% are folded away without pulling the red off-color;
+    # accents over 1% are found as colors of their own
+    monkeypatch.setitem(SYNTHETIC_FLAGS, 'accents', _accents_flag(square_side))
+    image, true_colors, _ = synthesize_flag('accents', width)
+    colors, _ = ColorProcessor(image).extract_colors(n_colors='auto')
+    _assert_palette(colors, true_colors[:n_expected])
+
+
+@pytest.mark.parametrize('flag', sorted(SYNTHETIC_FLAGS))
+def test_mixes_use_returned_palette(flag):
+    image, _, _ = synthesize_flag(flag, 320)
+    processor = ColorProcessor(image)
+    colors, proportions = processor.extract_colors(n_colors=8)
+    assert np.allclose(processor.get_equal_mix(),
+                       np.mean(colors, axis=0),
+                       atol=1)
+    assert np.allclose(processor.get_weighted_mix(),
+                       np.average(colors, axis=0, weights=proportions),
+                       atol=1)
+
+
+@pytest.mark.parametrize('flag', sorted(SYNTHETIC_FLAGS))
+def test_one_name_per_returned_color(flag):
+    image, _, _ = synthesize_flag(flag, 320)
+    processor = ColorProcessor(image)
+    colors, _ = processor.extract_colors(n_colors=8)
+    names = processor.get_color_names()
+    assert len(names) == len(colors)
+    assert all(isinstance(name, str) and name for name in names)
@@ -0,0 +1,33 @@
+import pytest
+
+from countries import all_countries, search_countries
+
+
+@pytest.mark.parametrize('query, code', [
+    ('Reunion', 'RE'),
+    ('germny', 'DE'),
+    ('uk', 'GB'),
+    ('de', 'DE'),
+    ('Holland', 'NL'),
+    ('texas', 'US-TX'),
+])
+def test_search_finds_best_match(query, code):
+    assert search_countries(query, limit=1, subdivisions=True)[0][0] == code
+
+
+def test_search_without_regions_skips_them():
+    assert search_countries('texas') == []
+    assert [code for code, _ in search_countries('georgia')] == ['GE', 'GS']
+
+
+def test_region_names_are_unique():
+    names = list(all_countries(subdivisions=True).values())
+    assert len(names) == len(set(names))
+    ranked = search_countries('georgia', limit=2, subdivisions=True)
+    assert ranked == [('GE', 'Georgia'), ('US-GA', 'Georgia (US)')]
+
+
+def test_empty_search_lists_everything_by_name():
+    ranked = search_countries('')
+    assert len(ranked) == len(all_countries())
+    assert [name for _, name in ranked] == sorted(all_countries().values())
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+import requests
+
+from conftest import flag_png
+from flag_cache import (FlagCache, FlagNotCachedError, InvalidFlagError,
+                        _umask, atomic_write)
+from http_client import HttpClient
+
+RED = flag_png((206, 17, 38))
+BLUE = flag_png((0, 56, 147))
+
+
+@pytest.fixture
+def client():
+    # One attempt, so failure cases do not wait on retries
+    client = HttpClient(max_attempts=1, timeout=2)
+    yield client
+    client.close()
+
+
+def _cache(tmp_path, url_template, client, offline=False):
+    return FlagCache(cache_dir=str(tmp_path),
+                     offline=offline,
+                     url_template=url_template,
+                     client=client)
+
+
+def test_revalidates_with_etag(tmp_path, flag_server, client):
+    flag_server.flags['fr'] = RED
+    cache = _cache(tmp_path, flag_server.url_template, client)
+    assert cache.fetch('FR', 40) == RED
+    assert cache.fetch('FR', 40) == RED
+    assert flag_server.statuses('fr') == [200, 304]
+    # A changed flag gets a new ETag and is downloaded again
+    flag_server.flags['fr'] = BLUE
+    assert cache.fetch('FR', 40) == BLUE
+    assert flag_server.statuses('fr') == [200, 304, 200]
+    assert cache.metadata('FR', 40)['etag'] is not None
+
+
+def test_offline_serves_disk_copy_or_raises(tmp_path, flag_server, client):
+    flag_server.flags['fr'] = RED
+    _cache(tmp_path, flag_server.url_template, client).fetch('FR', 40)
+    offline = _cache(tmp_path, flag_server.url_template, client, offline=True)
+    assert offline.fetch('FR', 40) == RED
+    with pytest.raises(FlagNotCachedError):
+        offline.fetch('JP', 40)
+    assert flag_server.statuses('fr') == [200]
+
+
+def test_serves_stale_copy_on_network_error(tmp_path, flag_server, client):
+    flag_server.flags['fr'] = RED
+    _cache(tmp_path, flag_server.url_template, client).fetch('FR', 40)
+    url_template = flag_server.url_template
+    flag_server.close()
+    cache = _cache(tmp_path, url_template, client)
+    assert cache.fetch('FR', 40) == RED
+    with pytest.raises(requests.ConnectionError):
+        cache.fetch('JP', 40)
+
+
+def test_rejects_non_png_body(tmp_path, flag_server, client):
+    flag_server.flags['fr'] = b'<html>Rate limited</html>'
+    cache = _cache(tmp_path, flag_server.url_template, client)
+    with pytest.raises(InvalidFlagError):
+        cache.fetch('FR', 40)
+    assert cache.metadata('FR', 40) is None
+    # With a good copy on disk, a bad body is replaced by the stale copy
+    flag_server.flags['fr'] = RED
+    assert cache.fetch('FR', 40) == RED
+    flag_server.flags['fr'] = b'not a png'
+    assert cache.fetch('FR', 40) == RED
+    assert cache.metadata('FR', 40)['sha256'] is not None
+
+
+def test_get_image_decodes_and_keeps_in_memory(tmp_path, flag_server, client):
+    flag_server.flags['fr'] = RED
+    cache = _cache(tmp_path, flag_server.url_template, client)
+    image = cache.get_image('FR', 40)
+    assert image.getpixel((0, 0))[:3] == (206, 17, 38)
+    assert cache.get_image('FR', 40) is image
+    assert flag_server.statuses('fr') == [200]
+
+
+def test_atomic_write_uses_current_umask(tmp_path):
+    path = str(tmp_path / 'flag.png')
+    previous = os.umask(0o027)
+    try:
+        assert _umask() == 0o027
+        atomic_write(path, RED)
+    finally:
+        os.umask(previous)
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    # Rewrites keep the existing file's mode
+    os.chmod(path, 0o600)
+    atomic_write(path, BLUE)
+    assert os.stat(path).st_mode & 0o777 == 0o600
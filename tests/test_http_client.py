@@ -0,0 +1,88 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+import utils
+from conftest import flag_png
+from flag_cache import FlagCache, InvalidFlagError
+from http_client import HttpClient
+
+RED = flag_png((206, 17, 38))
+
+
+def _client(**kwargs):
+    kwargs.setdefault('backoff', 0.001)
+    kwargs.setdefault('max_backoff', 0.01)
+    return HttpClient(**kwargs)
+
+
+def _url(server, code):
+    return server.url_template.format(width=40, code=code)
+
+
+@pytest.mark.parametrize('status', [503, 429])
+def test_retries_transient_status(flag_server, status):
+    flag_server.flags['fr'] = RED
+    flag_server.script['fr'] = [status, status]
+    response = _client(max_attempts=4).get(_url(flag_server, 'fr'))
+    assert response.status_code == 200
+    assert response.content == RED
+    assert flag_server.statuses('fr') == [status, status, 200]
+
+
+def test_retries_stop_at_max_attempts(flag_server):
+    flag_server.flags['fr'] = RED
+    flag_server.script['fr'] = [503] * 10
+    with pytest.raises(requests.HTTPError) as raised:
+        _client(max_attempts=3).get(_url(flag_server, 'fr'))
+    assert raised.value.response.status_code == 503
+    assert flag_server.statuses('fr') == [503] * 3
+
+
+def test_other_statuses_are_not_retried(flag_server):
+    response = _client(max_attempts=3).get(_url(flag_server, 'xx'))
+    assert response.status_code == 404
+    assert flag_server.statuses('xx') == [404]
+
+
+def test_timeout_is_retried_then_raised(flag_server):
+    flag_server.flags['fr'] = RED
+    flag_server.delay = 1
+    client = _client(max_attempts=2, timeout=(1, 0.1))
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        client.get(_url(flag_server, 'fr'))
+    assert time.monotonic() - started < flag_server.delay
+    # The first attempt is still being served when the retry arrives
+    assert flag_server.max_in_flight == 2
+
+
+def test_concurrency_is_capped(flag_server):
+    codes = [f'c{i}' for i in range(8)]
+    for code in codes:
+        flag_server.flags[code] = RED
+    flag_server.delay = 0.1
+    client = _client(max_concurrent=2, pool_size=8)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(
+            pool.map(lambda code: client.get(_url(flag_server, code)), codes))
+    assert all(response.status_code == 200 for response in responses)
+    assert flag_server.max_in_flight == 2
+
+
+def test_get_flag_images_reports_failures(tmp_path, flag_server, monkeypatch):
+    flag_server.flags['fr'] = RED
+    flag_server.flags['jp'] = b'<html>not a flag</html>'
+    cache = FlagCache(cache_dir=str(tmp_path),
+                      offline=False,
+                      url_template=flag_server.url_template,
+                      client=_client(max_attempts=2))
+    monkeypatch.setattr(utils, 'get_default_cache', lambda: cache)
+    images, failures = utils.get_flag_images(['FR', 'JP', 'XX'], width=40)
+    assert list(images) == ['FR']
+    assert images['FR'].getpixel((0, 0))[:3] == (206, 17, 38)
+    assert set(failures) == {'JP', 'XX'}
+    assert isinstance(failures['JP'], InvalidFlagError)
+    assert isinstance(failures['XX'], requests.HTTPError)
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold import budgets in seconds for modules on the startup path of the app,
+# the CLI and batch workers
+IMPORT_BUDGETS = {
+    'utils': 0.5,
+    'color_processor': 0.5,
+    'batch': 0.6,
+    'color_clustering': 0.5,
+    'color_dataset': 0.5,
+    'color_names': 0.5,
+    'analyze': 0.2,
+}
+
+# Heavy dependencies that the budgeted modules only import on first use
+LAZY_DEPENDENCIES = ('sklearn', 'scipy', 'requests', 'plotly', 'streamlit',
+                     'pandas')
+
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'loaded': [name for name in {lazy!r} if name in sys.modules]
+}}))
+"""
+
+
+def _cold_import(module):
+    probe = _IMPORT_PROBE.format(module=module, lazy=LAZY_DEPENDENCIES)
+    output = subprocess.run([sys.executable, '-c', probe],
+                            cwd=ROOT,
+                            check=True,
+                            capture_output=True,
+                            text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', IMPORT_BUDGETS)
+def test_cold_import_within_budget(module):
+    results = [_cold_import(module) for _ in range(3)]
+    assert results[0]['loaded'] == []
+    # The fastest run is the least disturbed by machine noise
+    assert min(result['seconds']
+               for result in results) <= IMPORT_BUDGETS[module]
@@ -0,0 +1,42 @@
+import json
+
+from palette_store import PaletteStore
+
+
+def _add(store, owner, day):
+    return store.add(owner, 'France', ['#002654', '#ffffff', '#ed2939'],
+                     [0.33, 0.34, 0.33],
+                     timestamp=f'2026-01-{day:02d} 12:00:00')
+
+
+def test_owners_are_capped_at_their_newest_palettes():
+    store = PaletteStore(':memory:', max_per_owner=3)
+    for day in range(1, 6):
+        _add(store, 'alice', day)
+    _add(store, 'bob', 1)
+    kept = [palette['timestamp'][:10] for palette in store.page('alice')]
+    assert kept == ['2026-01-05', '2026-01-04', '2026-01-03']
+    assert store.count('bob') == 1
+
+
+def test_prune_inactive_drops_idle_owners_only():
+    store = PaletteStore(':memory:', retention_days=None)
+    store.add('alice', 'Japan', ['#ffffff', '#bc002d'], [0.8, 0.2])
+    _add(store, 'alice', 1)
+    _add(store, 'bob', 1)
+    assert store.prune_inactive(30) == 1
+    assert store.count('alice') == 2
+    assert store.count('bob') == 0
+
+
+def test_export_matches_indented_json_layout():
+    store = PaletteStore(':memory:')
+    assert json.loads(''.join(store.export_json('alice')))['palettes'] == []
+    _add(store, 'alice', 1)
+    _add(store, 'alice', 2)
+    exported = ''.join(store.export_json('alice'))
+    document = json.loads(exported)
+    assert exported == json.dumps(document, indent=2)
+    assert [set(palette) for palette in document['palettes']] == [{
+        'country', 'colors', 'proportions', 'timestamp', 'names'
+    }] * 2
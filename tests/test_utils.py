@@ -0,0 +1,22 @@
+import pytest
+
+from utils import hex_to_rgb, rgb_to_hex
+
+
+@pytest.mark.parametrize('hex_color, rgb', [
+    ('#b22234', (178, 34, 52)),
+    ('B22234', (178, 34, 52)),
+    ('#FFFFFF', (255, 255, 255)),
+])
+def test_hex_to_rgb(hex_color, rgb):
+    assert hex_to_rgb(hex_color) == rgb
+    assert rgb_to_hex(rgb) == '#' + hex_color.lstrip('#').lower()
+
+
+@pytest.mark.parametrize('hex_color', [
+    '#12345678', '1234567', '#12345', '#fff', '##123456', '#12345g', '',
+    ' #123456'
+])
+def test_hex_to_rgb_rejects_malformed_codes(hex_color):
+    with pytest.raises(ValueError):
+        hex_to_rgb(hex_color)
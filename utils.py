@@ -1,14 +1,38 @@
-import requests
-from PIL import Image
-from io import BytesIO
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from color_space import from_space, to_space
+from countries import get_country_list
+from flag_cache import get_default_cache
+from http_client import MAX_CONCURRENT_REQUESTS
 
 
-def get_flag_image(country_code):
-    """Fetch flag image from country-flags API."""
-    url = f"https://flagcdn.com/w640/{country_code.lower()}.png"
-    response = requests.get(url)
-    return Image.open(BytesIO(response.content))
+def get_flag_image(country_code, width=640):
+    """Fetch flag image from country-flags API through the local flag cache."""
+    return get_default_cache().get_image(country_code, width)
+
+
+def get_flag_images(country_codes, width=640,
+                    max_workers=MAX_CONCURRENT_REQUESTS):
+    """Fetch many flag images concurrently over the shared connection pool.
+
+    Returns a dict of images keyed by country code and a dict of failed
+    country codes mapped to their exception.
+    """
+    cache = get_default_cache()
+    images, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            code: pool.submit(cache.get_image, code, width)
+            for code in country_codes
+        }
+        for code, future in futures.items():
+            try:
+                images[code] = future.result()
+            except Exception as e:
+                failures[code] = e
+    return images, failures
 
 
 def rgb_to_hex(rgb):
@@ -16,123 +40,98 @@ def rgb_to_hex(rgb):
     return '#{:02x}{:02x}{:02x}'.format(rgb[0], rgb[1], rgb[2])
 
 
-def get_country_list():
-    """Return a list of country codes and names."""
-    return {
-        'US': 'United States',
-        'GB': 'United Kingdom',
-        'FR': 'France',
-        'DE': 'Germany',
-        'JP': 'Japan',
-        'BR': 'Brazil',
-        'IN': 'India',
-        'CN': 'China',
-        'RU': 'Russia',
-        'CA': 'Canada',
-        'AU': 'Australia',
-        'IT': 'Italy',
-        'ES': 'Spain',
-        'MX': 'Mexico',
-        'ZA': 'South Africa',
-        'KR': 'South Korea',
-        'NG': 'Nigeria',
-        'EG': 'Egypt',
-        'SA': 'Saudi Arabia',
-        'AR': 'Argentina',
-        'TR': 'Turkey',
-        'NL': 'Netherlands',
-        'SE': 'Sweden',
-        'CH': 'Switzerland',
-        'NO': 'Norway',
-        'FI': 'Finland',
-        'DK': 'Denmark',
-        'PL': 'Poland',
-        'PT': 'Portugal',
-        'GR': 'Greece',
-        'BE': 'Belgium',
-        'AT': 'Austria',
-        'TH': 'Thailand',
-        'VN': 'Vietnam',
-        'MY': 'Malaysia',
-        'PH': 'Philippines',
-        'SG': 'Singapore',
-        'NZ': 'New Zealand',
-        'ID': 'Indonesia',
-        'IR': 'Iran',
-        'PK': 'Pakistan',
-        'BD': 'Bangladesh',
-        'UA': 'Ukraine',
-        'IL': 'Israel',
-        'KE': 'Kenya',
-        'GH': 'Ghana',
-        'TZ': 'Tanzania',
-        'CO': 'Colombia',
-        'VE': 'Venezuela',
-        'CL': 'Chile',
-        'PE': 'Peru',
-        'CZ': 'Czech Republic',
-        'HU': 'Hungary',
-        'RO': 'Romania',
-        'SK': 'Slovakia',
-        'BG': 'Bulgaria',
-        'AE': 'United Arab Emirates',
-        'QA': 'Qatar',
-        'KW': 'Kuwait',
-        'OM': 'Oman',
-        'BH': 'Bahrain',
-        'LK': 'Sri Lanka',
-        'MM': 'Myanmar',
-        'KH': 'Cambodia',
-        'LA': 'Laos',
-        'NP': 'Nepal',
-        'ZW': 'Zimbabwe',
-        'ZM': 'Zambia',
-        'MW': 'Malawi',
-        'UG': 'Uganda',
-        'SD': 'Sudan',
-        'DZ': 'Algeria',
-        'MA': 'Morocco',
-        'TN': 'Tunisia',
-        'ET': 'Ethiopia',
-        'SN': 'Senegal',
-        'CI': 'Ivory Coast',
-        'ML': 'Mali',
-        'BF': 'Burkina Faso',
-        'SL': 'Sierra Leone',
-        'GM': 'Gambia',
-        'LR': 'Liberia',
-        'CM': 'Cameroon',
-        'CD': 'Democratic Republic of Congo',
-        'AO': 'Angola',
-        'MZ': 'Mozambique',
-        'BW': 'Botswana',
-        'NA': 'Namibia',
-        'SZ': 'Eswatini',
-        'LS': 'Lesotho',
-        'BJ': 'Benin',
-        'TG': 'Togo',
-        'GA': 'Gabon',
-        'GN': 'Guinea',
-        'TD': 'Chad',
-        'NE': 'Niger',
-        'ER': 'Eritrea',
-        'SO': 'Somalia',
-        'CF': 'Central African Republic',
-        'RW': 'Rwanda',
-        'BI': 'Burundi',
-        'MQ': 'Martinique',
-        'GP': 'Guadeloupe',
-        'RE': 'Réunion',
-    }
-
-
-def mix_colors(colors, weights=None):
-    """Mix colors together with optional weights."""
+def hex_to_rgb(hex_color):
+    """Convert hex color code to RGB tuple.
+
+    Raises ``ValueError`` unless the code is exactly six hex digits, with
+    or without a leading ``#``.
+    """
+    if not re.fullmatch(r'#?[0-9a-fA-F]{6}', hex_color):
+        raise ValueError(f"{hex_color!r} is not a hex color code")
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def file_sha256(path):
+    """Return the SHA-256 hex digest of a file, used as a dataset version."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as data_file:
+        for chunk in iter(lambda: data_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hex_to_rgb_array(hex_colors):
+    """Convert a sequence of hex color codes into an (N, 3) uint8 array."""
+    # Parse all codes in one pass by decoding the concatenated hex digits
+    digits = ''.join(hex_color.lstrip('#') for hex_color in hex_colors)
+    return np.frombuffer(bytes.fromhex(digits), dtype=np.uint8).reshape(-1, 3)
+
+
+_HEX_DIGITS = np.array([f"{i:02x}" for i in range(256)])
+
+
+def rgb_to_hex_array(colors):
+    """Convert an (N, 3) array of RGB colors into an array of hex codes."""
+    colors = np.asarray(colors, dtype=np.uint8).reshape(-1, 3)
+    return np.char.add(
+        np.char.add(np.char.add('#', _HEX_DIGITS[colors[:, 0]]),
+                    _HEX_DIGITS[colors[:, 1]]), _HEX_DIGITS[colors[:, 2]])
+
+
+def flatten_palettes(country_colors):
+    """Flatten a country colors dict into names, colors, proportions, offsets.
+
+    Palette ``i`` occupies rows ``offsets[i]:offsets[i + 1]`` of the flat
+    ``colors`` and ``proportions`` arrays.
+    """
+    names = list(country_colors)
+    palettes = [country_colors[name] for name in names]
+    lengths = np.array([len(palette['colors']) for palette in palettes],
+                       dtype=np.int64)
+    offsets = np.zeros(len(palettes) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    colors = hex_to_rgb_array(
+        [color for palette in palettes for color in palette['colors']])
+    proportions = np.array(
+        [prop for palette in palettes for prop in palette['proportions']],
+        dtype=np.float64)
+    return names, colors, proportions, offsets
+
+
+def mix_palettes(colors, offsets, weights=None, space='rgb'):
+    """Mix many palettes at once with segmented reductions.
+
+    ``colors`` is a flat (N, 3) array holding every palette back to back and
+    ``offsets`` marks where each palette starts, with a final entry equal to
+    N. Returns the weighted mixes (using ``weights``, or equal weights when
+    omitted) and the equal mixes as (P, 3) integer arrays. Colors are
+    averaged in the given working ``space`` and converted back to RGB.
+    """
+    colors = to_space(colors, space)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    starts = offsets[:-1][lengths > 0]
     if weights is None:
-        weights = np.ones(len(colors)) / len(colors)
-    # Normalize weights
-    weights = np.array(weights) / np.sum(weights)
-    # Convert colors to numpy array and mix
-    colors_array = np.array(colors)
-    mixed_color = np.sum(colors_array * weights[:, np.newaxis], axis=0)
-    return tuple(int(round(c)) for c in mixed_color)
+        weights = np.ones(len(colors))
+    weights = np.asarray(weights, dtype=np.float64)
+
+    color_sums = np.add.reduceat(colors, starts, axis=0)
+    weighted_sums = np.add.reduceat(colors * weights[:, np.newaxis],
+                                    starts,
+                                    axis=0)
+    weight_totals = np.add.reduceat(weights, starts)
+
+    weighted = np.zeros((len(lengths), 3))
+    equal = np.zeros((len(lengths), 3))
+    weighted[lengths > 0] = weighted_sums / weight_totals[:, np.newaxis]
+    equal[lengths > 0] = color_sums / lengths[lengths > 0, np.newaxis]
+    weighted = np.rint(from_space(weighted, space)).astype(int)
+    equal = np.rint(from_space(equal, space)).astype(int)
+    return weighted, equal
+
+
+def mix_colors(colors, weights=None, space='rgb'):
+    """Mix colors together with optional weights."""
+    weighted, _ = mix_palettes(colors, [0, len(colors)], weights, space)
+    return tuple(int(c) for c in weighted[0])